@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+
+from redis import asyncio as redis_asyncio
+
+from fair_scheduler import (
+    ENQUEUE_REQUEST,
+    PENDING_REQUESTS,
+    FairQueueKeys,
+    request_dedup_key,
+)
+from redis_client import (
+    DEFAULT_HEALTH_CHECK_INTERVAL,
+    DEFAULT_SOCKET_CONNECT_TIMEOUT,
+    REDIS_OP_SECONDS,
+)
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_CONNECTIONS = 8
+
+
+# asyncio counterpart of RedisClient for the chat bot, so Redis round trips never block
+# the event loop. twitchAPI runs command handlers on its own event loop in another
+# thread and asyncio connections can't be shared between loops, so each loop that
+# uses the client gets its own connection pool.
+class AsyncRedisClient:
+    def __init__(self, config):
+        self.host = config["redis"]["host"]
+        self.port = config["redis"]["port"] or 6379
+        self.max_connections = config["redis"].get(
+            "async_max_connections", DEFAULT_MAX_CONNECTIONS
+        )
+        self.health_check_interval = config["redis"].get(
+            "health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL
+        )
+        self.socket_connect_timeout = config["redis"].get(
+            "socket_connect_timeout", DEFAULT_SOCKET_CONNECT_TIMEOUT
+        )
+        self.clients = {}
+        self.script_queue = config["redis"]["job_queue"]
+        self.requested_script_queue = config["redis"]["requested_job_queue"]
+        self.script_request_queue = config["redis"]["request_queue"]
+        self.script_request_response_queue = config["redis"]["request_response_queue"]
+        self.fair_keys = FairQueueKeys(self.script_request_queue, config)
+
+    @property
+    def redis_client(self):
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = redis_asyncio.Redis(
+                host=self.host,
+                port=self.port,
+                max_connections=self.max_connections,
+                health_check_interval=self.health_check_interval,
+                socket_connect_timeout=self.socket_connect_timeout,
+                socket_keepalive=True,
+                retry_on_timeout=True,
+            )
+            self.clients[loop] = client
+        return client
+
+    async def wait_for_queue_content(self, queue, timeout):
+        # Suspends until an entry is pushed onto the queue, or returns None after timeout seconds
+        content = await self.redis_client.brpop(queue, timeout=timeout)
+        return content[1].decode("utf-8") if content else None
+
+    async def read_next_entries(self, queue=None, entries=3):
+        queue = queue or self.script_queue
+        content = await self.redis_client.lrange(queue, -1 * entries, -1)
+        return [entry.decode("utf-8") for entry in content]
+
+    async def enqueue_request(self, payload, priority=False):
+        # Returns ("queued" | "merged" | "duplicate", name of the first requester)
+        enqueue_script = self.redis_client.register_script(ENQUEUE_REQUEST)
+        with REDIS_OP_SECONDS.time(op="enqueue_request"):
+            (status, requester) = await enqueue_script(
+                keys=self.fair_keys.keys(),
+                args=self.fair_keys.dispatch_args()
+                + [
+                    request_dedup_key(payload),
+                    json.dumps(payload),
+                    payload["name"],
+                    "1" if priority else "0",
+                ],
+            )
+        return (status.decode("utf-8"), requester.decode("utf-8"))
+
+    async def read_pending_requests(self, entries=3):
+        pending_script = self.redis_client.register_script(PENDING_REQUESTS)
+        content = await pending_script(
+            keys=self.fair_keys.keys(), args=[self.fair_keys.user_prefix, entries]
+        )
+        return [entry.decode("utf-8") for entry in content]
+
+    async def close(self):
+        # Only the pool of the calling loop can be closed from here
+        client = self.clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
@@ -0,0 +1,42 @@
+import io
+import wave
+
+
+def read_wav(audio):
+    with wave.open(io.BytesIO(audio), "rb") as wav_file:
+        return (wav_file.getparams(), wav_file.readframes(wav_file.getnframes()))
+
+
+# Joins the clips into a single track with one header, returns the track along with
+# the (sample offset, sample count) of each clip within it and the sample rate
+def stitch_wav_clips(audio_clips):
+    if not audio_clips:
+        raise ValueError("no audio clips to stitch")
+
+    track_format = None
+    clip_timings = []
+    frames = []
+    offset = 0
+    for audio_clip in audio_clips:
+        params, clip_frames = read_wav(audio_clip)
+        clip_format = (params.nchannels, params.sampwidth, params.framerate)
+        if track_format is None:
+            track_format = clip_format
+        elif clip_format != track_format:
+            raise ValueError(
+                f"can't stitch clips with different formats {clip_format} and {track_format}"
+            )
+        frame_count = len(clip_frames) // (params.nchannels * params.sampwidth)
+        clip_timings.append((offset, frame_count))
+        frames.append(clip_frames)
+        offset += frame_count
+
+    (nchannels, sampwidth, framerate) = track_format
+    track = io.BytesIO()
+    with wave.open(track, "wb") as wav_file:
+        wav_file.setnchannels(nchannels)
+        wav_file.setsampwidth(sampwidth)
+        wav_file.setframerate(framerate)
+        wav_file.writeframes(b"".join(frames))
+
+    return (track.getvalue(), clip_timings, framerate)
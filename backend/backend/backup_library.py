@@ -0,0 +1,125 @@
+import constants
+import logging
+import time
+import uuid
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_SCRIPTS = 30
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# KEYS: index zset, sizes hash, total bytes counter
+# ARGV: id, payload, timestamp, max scripts, max bytes, payload key prefix
+ADD_BACKUP_SCRIPT = """
+local size = string.len(ARGV[2])
+redis.call("SET", ARGV[6] .. ARGV[1], ARGV[2])
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+redis.call("HSET", KEYS[2], ARGV[1], size)
+local total = redis.call("INCRBY", KEYS[3], size)
+local evicted = 0
+while redis.call("ZCARD", KEYS[1]) > tonumber(ARGV[4])
+    or (total > tonumber(ARGV[5]) and redis.call("ZCARD", KEYS[1]) > 1) do
+    local oldest_id = redis.call("ZPOPMIN", KEYS[1])[1]
+    local oldest_size = tonumber(redis.call("HGET", KEYS[2], oldest_id) or "0")
+    redis.call("HDEL", KEYS[2], oldest_id)
+    redis.call("DEL", ARGV[6] .. oldest_id)
+    total = redis.call("DECRBY", KEYS[3], oldest_size)
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+# KEYS: index zset
+# ARGV: payload key prefix
+PICK_BACKUP_SCRIPT = """
+local ids = redis.call("ZRANDMEMBER", KEYS[1], 1)
+if #ids == 0 then
+    return false
+end
+return {ids[1], redis.call("GET", ARGV[1] .. ids[1])}
+"""
+
+# KEYS: index zset, sizes hash, total bytes counter
+# ARGV: id, payload key prefix
+REMOVE_BACKUP_SCRIPT = """
+if redis.call("ZREM", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local size = tonumber(redis.call("HGET", KEYS[2], ARGV[1]) or "0")
+redis.call("HDEL", KEYS[2], ARGV[1])
+redis.call("DECRBY", KEYS[3], size)
+redis.call("DEL", ARGV[2] .. ARGV[1])
+return 1
+"""
+
+
+# Library of finished scripts to fall back on when generation fails. Scripts are indexed
+# by a random id in a sorted set (scored by when they were added), so any number of
+# generator processes can add to it without overwriting each other, picking one is O(1),
+# and the oldest scripts get evicted once the count or byte budget is exceeded.
+class BackupScriptLibrary:
+    def __init__(self, redis_client, config):
+        self.redis_client = redis_client
+        self.max_scripts = config["redis"].get(
+            "backup_max_scripts", DEFAULT_MAX_SCRIPTS
+        )
+        self.max_bytes = config["redis"].get("backup_max_bytes", DEFAULT_MAX_BYTES)
+        self.index_key = constants.REDIS_BACKUP_INDEX_KEY
+        # Kept outside of the backup_script_ prefix so the legacy import never sees them
+        self.sizes_key = f"{constants.REDIS_BACKUP_INDEX_KEY}:sizes"
+        self.bytes_key = f"{constants.REDIS_BACKUP_INDEX_KEY}:bytes"
+
+        self.add_script = redis_client.redis_client.register_script(ADD_BACKUP_SCRIPT)
+        self.pick_script = redis_client.redis_client.register_script(PICK_BACKUP_SCRIPT)
+        self.remove_script = redis_client.redis_client.register_script(
+            REMOVE_BACKUP_SCRIPT
+        )
+
+    def add(self, payload, client=None):
+        # Pass a pipeline as the client to make this part of a larger transaction
+        return self.add_script(
+            keys=[self.index_key, self.sizes_key, self.bytes_key],
+            args=[
+                uuid.uuid4().hex,
+                str(payload),
+                time.time(),
+                self.max_scripts,
+                self.max_bytes,
+                constants.REDIS_BACKUP_SCRIPT_KEY_PREFIX,
+            ],
+            client=client,
+        )
+
+    def pick_random(self):
+        # Returns (id, payload), the id is what remove takes
+        picked = self.pick_script(
+            keys=[self.index_key], args=[constants.REDIS_BACKUP_SCRIPT_KEY_PREFIX]
+        )
+        if not picked:
+            return (None, None)
+        (script_id, payload) = picked
+        return (script_id.decode("utf-8"), payload.decode("utf-8") if payload else None)
+
+    def remove(self, script_id):
+        return self.remove_script(
+            keys=[self.index_key, self.sizes_key, self.bytes_key],
+            args=[script_id, constants.REDIS_BACKUP_SCRIPT_KEY_PREFIX],
+        )
+
+    def size(self):
+        return self.redis_client.redis_client.zcard(self.index_key)
+
+    def import_legacy_scripts(self):
+        # Backups used to live in fixed backup_script_<n> slots, move them into the library
+        imported = 0
+        for key in self.redis_client.redis_client.scan_iter(
+            match=f"{constants.REDIS_SCRIPT_KEY_PREFIX}*", count=100
+        ):
+            payload = self.redis_client.redis_client.get(key)
+            if payload:
+                self.add(payload.decode("utf-8"))
+                imported += 1
+            self.redis_client.redis_client.delete(key)
+        if imported:
+            logger.info(f"imported {imported} legacy backup scripts")
+        return imported
@@ -0,0 +1,125 @@
+import constants
+import logging
+import math
+import metrics
+import threading
+import time
+
+logger = logging.getLogger()
+
+QUEUE_DEPTH = metrics.gauge("script_queue_depth", "Scripts waiting to be played")
+TARGET_DEPTH = metrics.gauge(
+    "script_queue_target_depth", "Buffer depth the generator is aiming for"
+)
+DRAIN_RATE = metrics.gauge(
+    "script_queue_drain_rate", "Scripts played per second, smoothed"
+)
+GENERATION_SECONDS = metrics.histogram(
+    "script_generation_seconds", "Time from picking a job to publishing its script"
+)
+
+DEFAULT_MIN_BUFFERED_SCRIPTS = 2
+DEFAULT_SAFETY_FACTOR = 2.0
+# A script plays for about a minute, and takes about as long to generate
+DEFAULT_DRAIN_RATE = 1 / 60
+DEFAULT_GENERATION_SECONDS = 60
+DEFAULT_RATE_WINDOW_SECONDS = 300
+GENERATION_SMOOTHING = 0.2
+
+
+# Sizes the script buffer from how fast the frontend drains it and how long a script
+# takes to generate, instead of fixed thresholds. The buffer is kept deep enough to
+# cover the drain over a few generations, and capped so finished scripts (and their
+# audio) don't pile up in Redis. Safe to share between the pipeline stage threads.
+class BufferController:
+    def __init__(self, config):
+        scheduler_cfg = config.get("scheduler", {})
+        self.min_buffered = scheduler_cfg.get(
+            "min_buffered_scripts", DEFAULT_MIN_BUFFERED_SCRIPTS
+        )
+        self.max_buffered = scheduler_cfg.get(
+            "max_buffered_scripts", constants.MAX_BUFFERED_SCRIPTS
+        )
+        self.safety_factor = scheduler_cfg.get(
+            "buffer_safety_factor", DEFAULT_SAFETY_FACTOR
+        )
+        self.idle_wait = scheduler_cfg.get(
+            "idle_wait_seconds", constants.IDLE_WAIT_SECONDS
+        )
+        self.rate_window = scheduler_cfg.get(
+            "rate_window_seconds", DEFAULT_RATE_WINDOW_SECONDS
+        )
+
+        self.drain_rate = DEFAULT_DRAIN_RATE
+        self.generation_seconds = DEFAULT_GENERATION_SECONDS
+        self.last_length = None
+        self.last_observed = None
+        self.lock = threading.Lock()
+
+    def observe(self, length):
+        # Called with every LLEN of the script queue, anything missing since the last
+        # reading was played by the frontend
+        with self.lock:
+            now = time.monotonic()
+            if self.last_length is not None:
+                elapsed = now - self.last_observed
+                if elapsed > 0:
+                    drained = max(0, self.last_length - length)
+                    # Time weighted, so bursts of readings don't outweigh long quiet gaps
+                    decay = math.exp(-elapsed / self.rate_window)
+                    self.drain_rate = self.drain_rate * decay + (drained / elapsed) * (
+                        1 - decay
+                    )
+            self.last_length = length
+            self.last_observed = now
+        QUEUE_DEPTH.set(length)
+        DRAIN_RATE.set(self.drain_rate)
+        TARGET_DEPTH.set(self.target_depth())
+
+    def record_published(self, length):
+        # Length right after our own push, so it doesn't count as negative drain
+        with self.lock:
+            self.last_length = length
+            self.last_observed = time.monotonic()
+
+    def record_generation(self, seconds):
+        GENERATION_SECONDS.observe(seconds)
+        with self.lock:
+            self.generation_seconds += GENERATION_SMOOTHING * (
+                seconds - self.generation_seconds
+            )
+
+    def target_depth(self):
+        # Scripts played while the next few are being generated, plus some headroom
+        with self.lock:
+            needed = self.drain_rate * self.generation_seconds * self.safety_factor
+        return min(self.max_buffered, max(self.min_buffered, math.ceil(needed)))
+
+    def low_water_mark(self):
+        # Below this the queue runs dry before a retried script could be finished
+        with self.lock:
+            needed = self.drain_rate * self.generation_seconds
+        return min(self.target_depth(), max(1, math.ceil(needed)))
+
+    def should_generate(self, length, in_flight=0):
+        # Scripts still being generated will land in the buffer too
+        return length + in_flight < self.target_depth()
+
+    def needs_backup(self, length):
+        return length < self.low_water_mark()
+
+    def wait_seconds(self, length, in_flight=0):
+        # Roughly how long until the buffer drains below the target again
+        excess = length + in_flight - self.target_depth() + 1
+        with self.lock:
+            drain_rate = self.drain_rate
+        if drain_rate <= 0:
+            return self.idle_wait
+        return min(self.idle_wait, max(1, excess / drain_rate))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "drain_rate": self.drain_rate,
+                "generation_seconds": self.generation_seconds,
+            }
@@ -1,88 +1,53 @@
+import json
 import logging
-import re
 import constants
-import csv
-import unidecode
-import requests
+import metrics
 
+from functools import partial
 from retry import retry
-from io import StringIO
 from openai import OpenAI
+from circuit_breaker import CircuitBreaker, guarded
+from deadlines import DeadlineExceeded, check_deadline, remaining
+from llm_pool import LLMHostPool
+from script_parser import ScriptRowParser, parse_script
 
 logger = logging.getLogger()
 
+PARSE_SECONDS = metrics.histogram(
+    "script_parse_seconds", "Time spent parsing LLM output"
+)
+PARSE_FAILURES = metrics.counter(
+    "script_parse_failures_total", "LLM responses that parsed to no script lines"
+)
+
+DEFAULT_OPENAI_TIMEOUT = 120
 
-class ChatGPTClient:
 
+class ChatGPTClient:
     def __init__(self, config):
-        self.local_llama_host_url = config["local-llama"]["host"]
-        self.openAIclient = OpenAI(api_key=config["chatgpt"]["api_access_token"])
+        self.local_llama_pool = LLMHostPool(config)
+        self.openai_timeout = config["chatgpt"].get("timeout", DEFAULT_OPENAI_TIMEOUT)
+        self.openAIclient = OpenAI(
+            api_key=config["chatgpt"]["api_access_token"], timeout=self.openai_timeout
+        )
+        self.openai_breaker = CircuitBreaker.from_config(config["chatgpt"], "openai")
+        # Requested scripts start on both backends at once instead of falling back
+        self.race_local = config["chatgpt"].get("race_local", False)
+        # Asks llama.cpp style servers to keep the prompt's KV cache, so the next script
+        # only processes what comes after the shared instructions
+        self.cache_prompt = config["local-llama"].get("cache_prompt", True)
 
     def _trim_response(self, response):
         logger.info(f"raw chatgpt response: {response}")
-        beginning_regex = r"^(.*)```.*\"?\s*name\s*\"?,\s*\"?gender\s*\"?,"
-        end_regex = r"```(.*)$"
-        title_line_regex = r"\|\s*-*\s*\|\s*-*\s*\|\s*-*\s*\|"
-        front_trimmed_response = re.sub(
-            beginning_regex,
-            "Name|Gender|",
-            response,
-            1,
-            re.DOTALL | re.MULTILINE | re.IGNORECASE,
-        )
-        back_trimmed_response = re.sub(
-            end_regex,
-            "",
-            front_trimmed_response,
-            1,
-            re.DOTALL | re.MULTILINE | re.IGNORECASE,
-        )
-        split_lines = [
-            line
-            for line in back_trimmed_response.split("\n")
-            if line.strip() != "" and not re.findall(title_line_regex, line)
-        ]
-        title_line = split_lines[0].lower()
-        if "gender" not in title_line or "name" not in title_line:
-            split_lines = ["name|gender|text"] + split_lines
-        # we can't trust chatGPT output here, so replace entirely
-        split_lines[0] = "name|gender|text"
-
-        updated_lines = []
-        build_up_line = ""
-        for line in split_lines:
-            if not line:
-                continue
-            if line.count("|") >= 2:
-                if build_up_line:
-                    updated_lines.append(build_up_line)
-                build_up_line = line
-            else:
-                build_up_line += f" {line}"
-        if build_up_line:
-            updated_lines.append(build_up_line)
-
-        split_lines = [
-            line.rstrip("|").lstrip("|")
-            for line in updated_lines
-            if line.count("|") >= 2 and line.count("-|") < 2
-        ]
-
-        newline_trimmed_response = (
-            "\n".join(split_lines).replace("\\n", "\n").replace("\\t", "\t")
-        )
-
-        f = StringIO(unidecode.unidecode(newline_trimmed_response))
-        reader = csv.DictReader(
-            f, delimiter="|", skipinitialspace=True, quoting=csv.QUOTE_NONE
-        )
-        script_components = [line for line in reader]
-        if len(script_components) <= 0:
+        with PARSE_SECONDS.time():
+            script_rows = parse_script(response)
+        if len(script_rows) <= 0:
+            PARSE_FAILURES.inc()
             raise RuntimeError("script components will be empty")
 
-        return newline_trimmed_response
+        return script_rows
 
-    def generate(self, prompt):
+    def generate(self, prompt, deadline=None):
         logger.info(f"submitting the following prompt: {prompt}")
         api_response = None
         # text-generation-ui has API server similar to OpenAI
@@ -92,40 +57,129 @@ class ChatGPTClient:
             "stream": False,
             "messages": request,
             "max_tokens": 2048,
+            "cache_prompt": self.cache_prompt,
         }
 
         parsed_response = None
         try:
-            api_response = (
-                requests.post(
-                    self.local_llama_host_url + "/v1/chat/completions",
-                    headers={"Content-Type": "application/json"},
-                    json=payload,
-                    verify=False,
+            if self.local_llama_pool.hedging:
+                # Hedges race on who starts producing lines first, so they're streamed
+                payload["stream"] = True
+                parsed_response = list(
+                    self.local_llama_pool.stream_rows(
+                        payload,
+                        partial(self._read_script_rows, deadline=deadline),
+                        deadline=deadline,
+                    )
                 )
-                .json()["choices"][0]["message"]["content"]
-                .strip()
-            )
-            # Do some trimming on the LLAMA specific response, then do general trimming
-            # TODO: Make this trimming service/model agnostic
-            parsed_response = self._trim_response(
-                self._trim_llama_response(api_response)
-            )
+                if len(parsed_response) <= 0:
+                    PARSE_FAILURES.inc()
+                    raise RuntimeError("script components will be empty")
+            else:
+                api_response = self.local_llama_pool.post(payload, deadline=deadline)[
+                    "choices"
+                ][0]["message"]["content"].strip()
+                parsed_response = self._trim_response(api_response)
         except Exception:
             logging.exception("error whilst processing output, resetting")
 
         return parsed_response
 
-    @retry(RuntimeError, tries=3, delay=2)
-    def generate_real_openapi(self, prompt, insert_system_prompt=False):
+    def generate_stream(self, prompt, deadline=None):
+        logger.info(f"submitting the following streaming prompt: {prompt}")
+        request = self._generate_request_payload(prompt, insert_system_prompt=False)
+        payload = {
+            "mode": "instruct",
+            "stream": True,
+            "messages": request,
+            "max_tokens": 2048,
+            "cache_prompt": self.cache_prompt,
+        }
+
+        yield from self.local_llama_pool.stream_rows(
+            payload,
+            partial(self._read_script_rows, deadline=deadline),
+            deadline=deadline,
+        )
+
+    def generate_real_openapi_stream(
+        self, prompt, insert_system_prompt=False, deadline=None
+    ):
         request = self._generate_request_payload(prompt, insert_system_prompt)
-        completion = self.openAIclient.chat.completions.create(
-            model="gpt-4-1106-preview",
-            temperature=0.8,
-            presence_penalty=0,
-            frequency_penalty=0.6,
-            messages=request,
+        timeout = self._openai_timeout(deadline)
+        with guarded(self.openai_breaker, deadline):
+            stream = self.openAIclient.chat.completions.create(
+                model="gpt-4-1106-preview",
+                temperature=0.8,
+                presence_penalty=0,
+                frequency_penalty=0.6,
+                messages=request,
+                stream=True,
+                timeout=timeout,
+            )
+            try:
+                yield from self._stream_script_rows(
+                    (
+                        chunk.choices[0].delta.content
+                        for chunk in stream
+                        if chunk.choices and chunk.choices[0].delta.content
+                    ),
+                    deadline=deadline,
+                )
+            finally:
+                # Stops the generation if the stream is abandoned early
+                stream.close()
+
+    def _openai_timeout(self, deadline):
+        check_deadline(deadline, "the OpenAI request")
+        time_left = remaining(deadline)
+        if time_left is None:
+            return self.openai_timeout
+        return min(self.openai_timeout, time_left)
+
+    def _read_script_rows(self, response, deadline=None):
+        return self._stream_script_rows(
+            self._read_sse_content(response), deadline=deadline
         )
+
+    def _read_sse_content(self, response):
+        # Server sent events, each token delta comes in as a "data: {json}" line
+        for line in response.iter_lines():
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                return
+            content = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            if content:
+                yield content
+
+    def _stream_script_rows(self, chunks, deadline=None):
+        parser = ScriptRowParser()
+        raw_response = []
+        for chunk in chunks:
+            # The read timeout only catches a stalled stream, not one that's too slow
+            if deadline is not None and remaining(deadline) <= 0:
+                raise DeadlineExceeded("script deadline passed while generating")
+            raw_response.append(chunk)
+            yield from parser.feed(chunk)
+        yield from parser.close()
+        logger.info(f"raw streamed response: {''.join(raw_response)}")
+
+    @retry(RuntimeError, tries=3, delay=2)
+    def generate_real_openapi(self, prompt, insert_system_prompt=False, deadline=None):
+        request = self._generate_request_payload(prompt, insert_system_prompt)
+        timeout = self._openai_timeout(deadline)
+        with guarded(self.openai_breaker, deadline):
+            completion = self.openAIclient.chat.completions.create(
+                model="gpt-4-1106-preview",
+                temperature=0.8,
+                presence_penalty=0,
+                frequency_penalty=0.6,
+                messages=request,
+                timeout=timeout,
+            )
         raw_response = self._trim_response(
             completion.choices[0].message.content.strip()
         )
@@ -157,25 +211,3 @@ class ChatGPTClient:
                 }
             )
         return request
-
-    def _trim_llama_response(self, response):
-        split_lines = response.split("\n")
-        # Trim off fist lines until header
-        # (local model, so reasonable assurance that results are reproducable)
-        for i in range(len(split_lines)):
-            trimmed_line = [c.strip() for c in split_lines[0].lower().split("|") if c]
-            if "name" in trimmed_line and "gender" in trimmed_line:
-                break
-            else:
-                split_lines = split_lines[1:]
-
-        split_lines = [line for line in split_lines if line.count("-") < 5]
-
-        # Remove last line if not a valid CSV line
-        try:
-            if split_lines[-1].count("|") < 2:
-                split_lines = split_lines[:-1]
-        except Exception as e:
-            logger.exception(f"Cannot parse result, lines were {split_lines}")
-
-        return "\n".join(split_lines)
@@ -0,0 +1,134 @@
+import logging
+import metrics
+import threading
+import time
+
+from contextlib import contextmanager
+from deadlines import DeadlineExceeded, deadline_passed
+
+logger = logging.getLogger()
+
+BREAKER_STATE = metrics.gauge(
+    "circuit_breaker_state", "Backend circuit breaker, 0 closed, 1 half open, 2 open"
+)
+BREAKER_TRIPS = metrics.counter(
+    "circuit_breaker_trips_total", "Times a backend's circuit breaker opened"
+)
+BREAKER_REJECTIONS = metrics.counter(
+    "circuit_breaker_rejections_total", "Calls failed fast by an open circuit breaker"
+)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+
+# Not a RuntimeError, so the @retry around the OpenAI call doesn't wait it out
+class CircuitOpenError(Exception):
+    pass
+
+
+# Fails calls to a backend fast once it has failed failure_threshold times in a row, so a
+# dead server costs a script nothing instead of a full timeout. After reset_timeout one
+# call is let through to probe it, success closes the circuit and failure opens it again.
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.lock = threading.Lock()
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], backend=name)
+
+    @classmethod
+    def from_config(cls, backend_config, name):
+        breaker_config = backend_config.get("circuit_breaker", {})
+        if breaker_config is False:
+            return None
+        return cls(
+            name,
+            failure_threshold=breaker_config.get(
+                "failure_threshold", DEFAULT_FAILURE_THRESHOLD
+            ),
+            reset_timeout=breaker_config.get("reset_timeout", DEFAULT_RESET_TIMEOUT),
+        )
+
+    def before_call(self):
+        with self.lock:
+            if (
+                self.state == OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self._set_state(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+                BREAKER_REJECTIONS.inc(backend=self.name)
+                raise CircuitOpenError(f"{self.name} circuit breaker is open")
+            if self.state == HALF_OPEN:
+                self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    BREAKER_TRIPS.inc(backend=self.name)
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def record_abandoned(self):
+        # The caller stopped waiting (lost a race), which says nothing about the backend
+        with self.lock:
+            self.probing = False
+
+    @contextmanager
+    def guard(self, deadline=None):
+        # Timeouts cut short by the script's deadline say nothing about the backend either
+        self.before_call()
+        try:
+            yield
+        except Exception as error:
+            if isinstance(error, DeadlineExceeded) or deadline_passed(deadline):
+                self.record_abandoned()
+            else:
+                self.record_failure()
+            raise
+        except BaseException:
+            self.record_abandoned()
+            raise
+        else:
+            self.record_success()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"{self.name} circuit breaker is now {state}")
+        self.state = state
+        BREAKER_STATE.set(STATE_VALUES[state], backend=self.name)
+
+
+@contextmanager
+def guarded(breaker, deadline=None):
+    # For backends with the breaker turned off
+    if breaker is None:
+        yield
+    else:
+        with breaker.guard(deadline):
+            yield
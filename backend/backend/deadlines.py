@@ -0,0 +1,39 @@
+import time
+
+# A script gets this long from being picked up to being rendered, across the LLM, parse
+# and TTS stages, before it's given up on for a backup
+DEFAULT_SCRIPT_DEADLINE_SECONDS = 600
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def script_deadline(config, started_at=None):
+    return (started_at or time.monotonic()) + config.get("scheduler", {}).get(
+        "script_deadline_seconds", DEFAULT_SCRIPT_DEADLINE_SECONDS
+    )
+
+
+def remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_passed(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check_deadline(deadline, stage):
+    if deadline_passed(deadline):
+        raise DeadlineExceeded(f"script deadline passed before {stage}")
+
+
+def request_timeout(timeout, deadline):
+    # (connect, read) timeouts for requests, with the read side cut short by the deadline
+    (connect_timeout, read_timeout) = timeout
+    if deadline is None:
+        return timeout
+    time_left = deadline - time.monotonic()
+    if time_left <= 0:
+        raise DeadlineExceeded("script deadline passed before the request")
+    return (min(connect_timeout, time_left), min(read_timeout, time_left))
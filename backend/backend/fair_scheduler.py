@@ -0,0 +1,164 @@
+import hashlib
+import re
+
+DEFAULT_PRIORITY_WEIGHT = 2
+DEFAULT_READY_DEPTH = 1
+
+# Shared by the enqueue and dispatch scripts. Requesters with pending requests sit on
+# one of two rings, each requester has their own list of request ids, and the payloads
+# live in a hash keyed by id. Dispatching rotates the ring and moves the head of the
+# next requester's list onto the ready queue the generators claim from, taking from the
+# priority ring priority_weight times for every turn of the normal ring.
+# KEYS: ready queue, normal ring, priority ring, payloads hash, turn counter
+DISPATCH_FUNCTION = """
+local function pick_ring(priority_weight)
+    local has_priority = redis.call("LLEN", KEYS[3]) > 0
+    local has_normal = redis.call("LLEN", KEYS[2]) > 0
+    if has_priority and has_normal then
+        local turn = redis.call("INCR", KEYS[5])
+        if turn % (priority_weight + 1) == 0 then
+            return KEYS[2]
+        end
+        return KEYS[3]
+    elseif has_priority then
+        return KEYS[3]
+    elseif has_normal then
+        return KEYS[2]
+    end
+    return nil
+end
+
+local function dispatch(user_prefix, priority_weight, ready_depth)
+    local dispatched = 0
+    while redis.call("LLEN", KEYS[1]) < ready_depth do
+        local ring = pick_ring(priority_weight)
+        if not ring then
+            break
+        end
+        local requester = redis.call("LMOVE", ring, ring, "LEFT", "RIGHT")
+        local user_queue = user_prefix .. requester
+        local id = redis.call("LPOP", user_queue)
+        if redis.call("LLEN", user_queue) == 0 then
+            redis.call("LREM", ring, 1, requester)
+        end
+        if id then
+            local payload = redis.call("HGET", KEYS[4], id)
+            redis.call("HDEL", KEYS[4], id)
+            if payload then
+                redis.call("LPUSH", KEYS[1], payload)
+                dispatched = dispatched + 1
+            end
+        end
+    end
+    return dispatched
+end
+"""
+
+# ARGV: user queue prefix, priority weight, ready depth
+DISPATCH_REQUESTS = (
+    DISPATCH_FUNCTION
+    + """
+return dispatch(ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]))
+"""
+)
+
+# Identical pending prompts are merged into the first request instead of being queued
+# again, everyone who asked gets told once it's done.
+# ARGV: user queue prefix, priority weight, ready depth, id, payload, requester, priority
+ENQUEUE_REQUEST = (
+    DISPATCH_FUNCTION
+    + """
+local pending = redis.call("HGET", KEYS[4], ARGV[4])
+if pending then
+    local request = cjson.decode(pending)
+    if request["name"] == ARGV[6] then
+        return {"duplicate", request["name"]}
+    end
+    local merged = request["merged"] or {}
+    for _, name in ipairs(merged) do
+        if name == ARGV[6] then
+            return {"duplicate", request["name"]}
+        end
+    end
+    table.insert(merged, ARGV[6])
+    request["merged"] = merged
+    redis.call("HSET", KEYS[4], ARGV[4], cjson.encode(request))
+    return {"merged", request["name"]}
+end
+
+redis.call("HSET", KEYS[4], ARGV[4], ARGV[5])
+local user_queue = ARGV[1] .. ARGV[6]
+if redis.call("LLEN", user_queue) == 0 then
+    redis.call("RPUSH", ARGV[7] == "1" and KEYS[3] or KEYS[2], ARGV[6])
+end
+redis.call("RPUSH", user_queue, ARGV[4])
+dispatch(ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]))
+return {"queued", ARGV[6]}
+"""
+)
+
+# Pending payloads in roughly the order they'll be dispatched, ready queue first
+# ARGV: user queue prefix, max entries
+PENDING_REQUESTS = """
+local max_entries = tonumber(ARGV[2])
+local pending = {}
+local ready = redis.call("LRANGE", KEYS[1], 0, -1)
+for index = #ready, 1, -1 do
+    if #pending >= max_entries then
+        return pending
+    end
+    table.insert(pending, ready[index])
+end
+local requesters = redis.call("LRANGE", KEYS[3], 0, -1)
+for _, requester in ipairs(redis.call("LRANGE", KEYS[2], 0, -1)) do
+    table.insert(requesters, requester)
+end
+for _, requester in ipairs(requesters) do
+    if #pending >= max_entries then
+        break
+    end
+    local id = redis.call("LINDEX", ARGV[1] .. requester, 0)
+    local payload = id and redis.call("HGET", KEYS[4], id)
+    if payload then
+        table.insert(pending, payload)
+    end
+end
+return pending
+"""
+
+
+def request_dedup_key(payload):
+    # Near identical prompts (case, punctuation, spacing) count as the same request
+    prompt = re.sub(r"[^\w\s]", "", payload["prompt"].lower())
+    prompt = " ".join(prompt.split())
+    key = f"{payload['type']}|{payload['scene_type']}|{prompt}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# Key layout and settings shared by the chat bot, which enqueues, and the generators,
+# which dispatch into the ready queue they claim from.
+class FairQueueKeys:
+    def __init__(self, request_queue, config):
+        self.ready_queue = request_queue
+        prefix = f"{request_queue}:fair"
+        self.normal_ring = f"{prefix}:requesters"
+        self.priority_ring = f"{prefix}:priority_requesters"
+        self.payloads = f"{prefix}:payloads"
+        self.turn = f"{prefix}:turn"
+        self.user_prefix = f"{prefix}:user:"
+        self.priority_weight = config["redis"].get(
+            "fair_priority_weight", DEFAULT_PRIORITY_WEIGHT
+        )
+        self.ready_depth = config["redis"].get("fair_ready_depth", DEFAULT_READY_DEPTH)
+
+    def keys(self):
+        return [
+            self.ready_queue,
+            self.normal_ring,
+            self.priority_ring,
+            self.payloads,
+            self.turn,
+        ]
+
+    def dispatch_args(self):
+        return [self.user_prefix, self.priority_weight, self.ready_depth]
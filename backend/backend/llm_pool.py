@@ -0,0 +1,285 @@
+import logging
+import metrics
+import queue
+import random
+import requests
+import threading
+import time
+
+from circuit_breaker import CircuitBreaker, guarded
+from collections import deque
+from deadlines import request_timeout
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger()
+
+HOST_OUTSTANDING = metrics.gauge(
+    "llm_host_outstanding", "Local LLM requests in flight, by host"
+)
+FIRST_ROW_SECONDS = metrics.histogram(
+    "llm_first_row_seconds",
+    "Time until a local LLM stream produced its first script line",
+)
+HEDGED_REQUESTS = metrics.counter(
+    "llm_hedged_requests_total", "Local LLM requests duplicated to a second host"
+)
+HEDGE_WINS = metrics.counter(
+    "llm_hedge_wins_total", "Hedged requests where the duplicate got going first"
+)
+
+COMPLETIONS_PATH = "/v1/chat/completions"
+DEFAULT_CONNECT_TIMEOUT = 5
+# Without streaming this covers the whole generation, with it the gaps between tokens
+DEFAULT_READ_TIMEOUT = 300
+DEFAULT_HEDGE_PERCENTILE = 0.95
+# Until enough streams have been timed to know what slow looks like
+DEFAULT_HEDGE_DELAY = 30
+DEFAULT_HEDGE_MIN_SAMPLES = 10
+HEDGE_SAMPLE_WINDOW = 200
+# Marks an attempt's stream as finished on the shared event queue
+STREAM_DONE = object()
+
+
+class LLMHost:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+
+
+# One streamed request to one host, read on its own thread so it can be raced against
+# a hedge and dropped if it loses
+class LLMStreamAttempt:
+    def __init__(self, pool, host, payload, read_rows, events, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.host = host
+        self.payload = payload
+        self.read_rows = read_rows
+        self.events = events
+        self.started_at = time.monotonic()
+        self.error = None
+        self.response = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, name="llm-stream", daemon=True).start()
+
+    def _run(self):
+        first_row = True
+        try:
+            response = self.pool.session.post(
+                self.host.url + COMPLETIONS_PATH,
+                headers={"Content-Type": "application/json"},
+                json=self.payload,
+                verify=False,
+                stream=True,
+                timeout=self.timeout,
+            )
+            with self.lock:
+                self.response = response
+                cancelled = self.cancelled
+            with response:
+                if cancelled:
+                    return
+                response.raise_for_status()
+                for row in self.read_rows(response):
+                    if self.cancelled:
+                        return
+                    if first_row:
+                        self.pool.record_first_row(
+                            self.host, time.monotonic() - self.started_at
+                        )
+                        first_row = False
+                    self.events.put((self, row))
+        except Exception as error:
+            if not self.cancelled:
+                self.error = error
+        finally:
+            self.pool.release(self.host)
+            self.events.put((self, STREAM_DONE))
+
+    def cancel(self):
+        # Dropping the connection is what stops the backend generating
+        with self.lock:
+            self.cancelled = True
+            response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+# Several OpenAI compatible local backends (text-generation-webui, llama.cpp), each
+# request goes to the one with the fewest requests in flight. With hedging on, a stream
+# that hasn't produced a script line by the hedge_percentile of recent first line times
+# gets duplicated to another host, whichever produces a line first is kept and the other
+# is cancelled.
+class LLMHostPool:
+    def __init__(self, config):
+        llama_cfg = config["local-llama"]
+        urls = llama_cfg.get("hosts") or [llama_cfg["host"]]
+        self.hosts = [LLMHost(url) for url in urls]
+        self.hedge = llama_cfg.get("hedge", False)
+        self.hedge_percentile = llama_cfg.get(
+            "hedge_percentile", DEFAULT_HEDGE_PERCENTILE
+        )
+        self.hedge_delay = llama_cfg.get("hedge_delay", DEFAULT_HEDGE_DELAY)
+        self.hedge_min_samples = llama_cfg.get(
+            "hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES
+        )
+        self.first_row_times = deque(maxlen=HEDGE_SAMPLE_WINDOW)
+        self.timeout = (
+            llama_cfg.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            llama_cfg.get("timeout", DEFAULT_READ_TIMEOUT),
+        )
+        self.breaker = CircuitBreaker.from_config(llama_cfg, "local")
+        self.lock = threading.Lock()
+
+        # Every in-flight request and hedge gets its own keep-alive connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.hosts), pool_maxsize=len(self.hosts) * 2
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def hedging(self):
+        return self.hedge and len(self.hosts) > 1
+
+    def acquire(self, exclude=()):
+        with self.lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            if not candidates:
+                return None
+            host = min(candidates, key=lambda host: (host.outstanding, random.random()))
+            host.outstanding += 1
+            HOST_OUTSTANDING.set(host.outstanding, host=host.url)
+            return host
+
+    def release(self, host):
+        with self.lock:
+            host.outstanding -= 1
+            HOST_OUTSTANDING.set(host.outstanding, host=host.url)
+
+    def record_first_row(self, host, seconds):
+        FIRST_ROW_SECONDS.observe(seconds, host=host.url)
+        with self.lock:
+            self.first_row_times.append(seconds)
+
+    def hedge_after(self):
+        with self.lock:
+            if len(self.first_row_times) < self.hedge_min_samples:
+                return self.hedge_delay
+            samples = sorted(self.first_row_times)
+        return samples[int(self.hedge_percentile * (len(samples) - 1))]
+
+    def post(self, payload, deadline=None):
+        timeout = request_timeout(self.timeout, deadline)
+        with guarded(self.breaker, deadline):
+            host = self.acquire()
+            try:
+                response = self.session.post(
+                    host.url + COMPLETIONS_PATH,
+                    headers={"Content-Type": "application/json"},
+                    json=payload,
+                    verify=False,
+                    timeout=timeout,
+                )
+                response.raise_for_status()
+                return response.json()
+            finally:
+                self.release(host)
+
+    def stream_rows(self, payload, read_rows, deadline=None):
+        # read_rows turns a streamed response into script lines, and is expected to give
+        # up once the deadline passes
+        timeout = request_timeout(self.timeout, deadline)
+        with guarded(self.breaker, deadline):
+            if self.hedging:
+                yield from self._hedged_stream_rows(payload, read_rows, timeout)
+            else:
+                yield from self._stream_rows(payload, read_rows, timeout)
+
+    def _stream_rows(self, payload, read_rows, timeout):
+        host = self.acquire()
+        tm1 = time.monotonic()
+        try:
+            with self.session.post(
+                host.url + COMPLETIONS_PATH,
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                verify=False,
+                stream=True,
+                timeout=timeout,
+            ) as response:
+                response.raise_for_status()
+                first_row = True
+                for row in read_rows(response):
+                    if first_row:
+                        self.record_first_row(host, time.monotonic() - tm1)
+                        first_row = False
+                    yield row
+        finally:
+            self.release(host)
+
+    def _hedged_stream_rows(self, payload, read_rows, timeout):
+        events = queue.Queue()
+        attempts = [
+            LLMStreamAttempt(self, self.acquire(), payload, read_rows, events, timeout)
+        ]
+        hedge_at = time.monotonic() + self.hedge_after()
+        running = 1
+        winner = None
+        try:
+            while winner is None:
+                wait = None if hedge_at is None else max(0, hedge_at - time.monotonic())
+                try:
+                    (attempt, row) = events.get(timeout=wait)
+                except queue.Empty:
+                    hedge_at = None
+                    host = self.acquire(exclude=[attempt.host for attempt in attempts])
+                    logger.warning(
+                        f"no script from {attempts[0].host.url} yet, hedging to {host.url}"
+                    )
+                    HEDGED_REQUESTS.inc()
+                    attempts.append(
+                        LLMStreamAttempt(
+                            self, host, payload, read_rows, events, timeout
+                        )
+                    )
+                    running += 1
+                    continue
+
+                if row is STREAM_DONE:
+                    running -= 1
+                    if running > 0:
+                        continue
+                    if hedge_at is None:
+                        raise attempt.error or RuntimeError(
+                            "local LLM stream ended without any script lines"
+                        )
+                    # Failed before the hedge was due, so there's no point waiting for it
+                    logger.warning(f"{attempt.host.url} failed due to {attempt.error}")
+                    hedge_at = time.monotonic()
+                    continue
+                winner = attempt
+                if winner is not attempts[0]:
+                    HEDGE_WINS.inc()
+                for attempt in attempts:
+                    if attempt is not winner:
+                        attempt.cancel()
+                yield row
+
+            while True:
+                (attempt, row) = events.get()
+                if attempt is not winner:
+                    continue
+                if row is STREAM_DONE:
+                    break
+                yield row
+            if winner.error:
+                raise winner.error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
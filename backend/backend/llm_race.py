@@ -0,0 +1,129 @@
+import logging
+import metrics
+import queue
+import threading
+
+logger = logging.getLogger()
+
+RACE_WINS = metrics.counter(
+    "llm_race_wins_total", "Raced requested scripts, by the backend that won"
+)
+
+# Marks a backend's stream as finished on the shared event queue
+STREAM_DONE = object()
+# Anything shorter isn't a script, so the backend counts as failed
+MIN_SCRIPT_LINES = 2
+
+
+class ScriptRace:
+    # Runs every backend at once, each source maps to a function opening its stream of
+    # script lines. Lines are buffered per source until one of them is picked, and the
+    # others are cancelled as soon as it is.
+    def __init__(self, streams):
+        self.events = queue.Queue()
+        self.cancelled = {source: threading.Event() for source in streams}
+        self.lines = {source: [] for source in streams}
+        self.finished = set()
+        self.errors = {}
+        for source, open_stream in streams.items():
+            threading.Thread(
+                target=self._run,
+                args=(source, open_stream),
+                name=f"llm-race-{source}",
+                daemon=True,
+            ).start()
+
+    def _run(self, source, open_stream):
+        script_rows = None
+        try:
+            script_rows = open_stream()
+            for script_line in script_rows:
+                if self.cancelled[source].is_set():
+                    break
+                self.events.put((source, script_line))
+        except Exception as error:
+            self.errors[source] = error
+        finally:
+            # Closes the backend's connection from the thread that's reading it
+            if script_rows is not None and hasattr(script_rows, "close"):
+                script_rows.close()
+            self.events.put((source, STREAM_DONE))
+
+    def _next_event(self):
+        (source, script_line) = self.events.get()
+        if script_line is STREAM_DONE:
+            self.finished.add(source)
+            if source in self.errors:
+                logger.warning(
+                    f"{source} dropped out of the race: {self.errors[source]}"
+                )
+        elif not self.cancelled[source].is_set():
+            self.lines[source].append(script_line)
+        return source
+
+    def _failed(self, source):
+        if source not in self.finished:
+            return False
+        return source in self.errors or len(self.lines[source]) < MIN_SCRIPT_LINES
+
+    def _complete(self, source):
+        return source in self.finished and not self._failed(source)
+
+    def _started(self, source):
+        # Enough lines to tell a script apart from a refusal or a one-line reply
+        return len(self.lines[source]) >= MIN_SCRIPT_LINES
+
+    def _pick(self, ready):
+        # The first backend for which ready() holds wins, and the others stop at their
+        # next line rather than generating a script nobody will use
+        while not all(self._failed(source) for source in self.lines):
+            source = self._next_event()
+            if ready(source) and not self._failed(source):
+                self.cancel(keep=source)
+                RACE_WINS.inc(source=source)
+                logger.info(f"{source} won the race for the script")
+                return source
+        if self.errors:
+            # The last backend to drop out, e.g. a deadline that cut them all short
+            raise list(self.errors.values())[-1]
+        raise RuntimeError("no backend produced a script")
+
+    def cancel(self, keep=None):
+        for source, cancelled in self.cancelled.items():
+            if source != keep:
+                cancelled.set()
+
+    def _follow(self, source):
+        index = 0
+        while True:
+            while index < len(self.lines[source]):
+                yield self.lines[source][index]
+                index += 1
+            if source in self.finished:
+                if source in self.errors:
+                    raise self.errors[source]
+                return
+            self._next_event()
+
+    def script_rows(self):
+        try:
+            yield from self._follow(self._pick(self._started))
+        finally:
+            self.cancel()
+
+    def whole_script(self):
+        try:
+            return self.lines[self._pick(self._complete)]
+        finally:
+            self.cancel()
+
+
+def race_script_streams(streams):
+    # Streams the script of the first backend to produce a couple of lines. Until then
+    # a backend failing is simply dropped, after that the race is committed to it.
+    return ScriptRace(streams).script_rows()
+
+
+def race_scripts(streams):
+    # The first backend to finish a whole script wins, however late its first line was
+    return ScriptRace(streams).whole_script()
@@ -1,21 +1,50 @@
 import constants
+import base64
 import json
 import time
 import argparse
 import logging
 import random
+import uuid
+import metrics
 
 from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
+from functools import partial
 
 from redis_client import RedisClient
+from backup_library import BackupScriptLibrary
+from buffer_controller import BufferController
+from request_queue import ReliableRequestQueue
+from script_cache import ScriptCache
+from llm_race import race_script_streams, race_scripts
+from deadlines import check_deadline, script_deadline
 from chatgpt_client import ChatGPTClient
 from tts_client import TTSClient
-from script_generator import generate_files
+from pipeline import ScriptPipeline, StreamHandoff
+from segment_publisher import SegmentPublisher
+from script_generator import (
+    generate_files,
+    parse_script_lines,
+    render_script,
+    render_streamed_script,
+)
 from utils import generate_requested_script, prompt_customizations
 
 
-redis_script_key_counter = 0
+last_backup_push_time = 0
+
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "llm_request_seconds", "Time to generate a full script, by model"
+)
+LLM_FALLBACKS = metrics.counter(
+    "llm_fallbacks_total",
+    "Requested scripts that fell back from OpenAI to the local LLM",
+)
+SCRIPTS_PUBLISHED = metrics.counter("scripts_published_total", "Scripts put on a queue")
+SCRIPT_FAILURES = metrics.counter(
+    "script_failures_total", "Scripts that failed to generate, by stage"
+)
 
 
 logger = logging.getLogger()
@@ -31,6 +60,16 @@ parser = argparse.ArgumentParser(description="Generates podcast scripts")
 parser.add_argument(
     "--infinite", help="Keeps generating scripts non-stop", action="store_true"
 )
+parser.add_argument(
+    "--pipeline",
+    help="Only in conjunction with infinite, overlaps generating the next script with rendering the current one",
+    action="store_true",
+)
+parser.add_argument(
+    "--stream",
+    help="Streams the LLM output and starts the TTS for each line as soon as it's generated",
+    action="store_true",
+)
 parser.add_argument(
     "--test-request",
     help="generates a manual request with a test name and the provided prompt",
@@ -44,6 +83,11 @@ parser.add_argument(
     help="generates a manual business talk request with a test name and the provided prompt",
 )
 parser.add_argument("--request", help="Grabs the request", action="store_true")
+parser.add_argument(
+    "--fresh",
+    help="Always calls the LLM, even if the same prompt was generated recently",
+    action="store_true",
+)
 parser.add_argument(
     "--type",
     help="Generate a specifc type of script, only applicable in default mode",
@@ -59,16 +103,9 @@ parser.add_argument(
 )
 
 
-def fetch_prompt(
-    client,
-    guest_type,
-    script_prompt,
-    script_requester,
-    guest_personality=("", ""),
-    scene_type="podcast",
-):
+def build_prompt(guest_type, script_prompt, guest_personality=("", "")):
     prompt_customization = prompt_customizations[guest_type]
-    prompt = constants.DEFAULT_PROMPT_TEMPLATE.format(
+    return constants.DEFAULT_PROMPT_TEMPLATE.format(
         host_name=constants.DEFAULT_NAME,
         script_prompt=script_prompt,
         character_type=prompt_customization[0],
@@ -77,22 +114,325 @@ def fetch_prompt(
         character_postfix=guest_personality[1],
     )
 
+
+def generate_cached(use_cache, source, prompt, generate):
+    if use_cache:
+        script_lines = script_cache.get(source, prompt)
+        if script_lines:
+            return script_lines
+    with LLM_REQUEST_SECONDS.time(source=source):
+        script_lines = generate(prompt)
+    if use_cache:
+        script_cache.put(source, prompt, script_lines)
+    return script_lines
+
+
+def stream_cached(use_cache, source, prompt, generate_stream):
+    if use_cache:
+        script_lines = script_cache.get(source, prompt)
+        if script_lines:
+            yield from script_lines
+            return
+    script_lines = []
+    tm1 = time.perf_counter()
+    for script_line in generate_stream(prompt):
+        script_lines.append(script_line)
+        yield script_line
+    LLM_REQUEST_SECONDS.observe(time.perf_counter() - tm1, source=source)
+    if use_cache:
+        script_cache.put(source, prompt, script_lines)
+
+
+def race_prompt(race, client, prompt, api_prompt, use_cache, deadline=None):
+    logger.info(f"Racing OpenAI and the local LLM for {api_prompt}")
+    return race(
+        {
+            "openai": lambda: stream_cached(
+                use_cache,
+                "openai",
+                api_prompt,
+                partial(client.generate_real_openapi_stream, deadline=deadline),
+            ),
+            "local": lambda: stream_cached(
+                use_cache,
+                "local",
+                prompt,
+                partial(client.generate_stream, deadline=deadline),
+            ),
+        }
+    )
+
+
+def fetch_prompt(
+    client,
+    guest_type,
+    script_prompt,
+    script_requester,
+    guest_personality=("", ""),
+    scene_type="podcast",
+    use_cache=False,
+    deadline=None,
+):
+    prompt = build_prompt(guest_type, script_prompt, guest_personality)
+
     response = None
+    if script_requester and client.race_local:
+        api_prompt = generate_requested_script(
+            prompt_customization=prompt_customizations[guest_type],
+            script_prompt=script_prompt,
+            scene_type=scene_type,
+        )
+        return race_prompt(
+            race_scripts, client, prompt, api_prompt, use_cache, deadline
+        )
     if script_requester:
         # If this is a manual request, then get an entry from the real API first
         try:
             api_prompt = generate_requested_script(
-                prompt_customization=prompt_customization,
+                prompt_customization=prompt_customizations[guest_type],
                 script_prompt=script_prompt,
                 scene_type=scene_type,
             )
             logger.info(f"Generating direct OpenAI script for {api_prompt}")
-            response = client.generate_real_openapi(api_prompt)
+            response = generate_cached(
+                use_cache,
+                "openai",
+                api_prompt,
+                partial(client.generate_real_openapi, deadline=deadline),
+            )
         except Exception as e:
             logger.exception(f"direct OpenAI generation failed due to {e}")
+            LLM_FALLBACKS.inc()
             response = None
 
-    return response or client.generate(prompt)
+    return response or generate_cached(
+        use_cache, "local", prompt, partial(client.generate, deadline=deadline)
+    )
+
+
+def stream_prompt(
+    client,
+    guest_type,
+    script_prompt,
+    script_requester,
+    guest_personality=("", ""),
+    scene_type="podcast",
+    use_cache=False,
+    deadline=None,
+):
+    # Same fallback order as fetch_prompt, but yields each script line as it's generated
+    prompt = build_prompt(guest_type, script_prompt, guest_personality)
+
+    if script_requester and client.race_local:
+        api_prompt = generate_requested_script(
+            prompt_customization=prompt_customizations[guest_type],
+            script_prompt=script_prompt,
+            scene_type=scene_type,
+        )
+        yield from race_prompt(
+            race_script_streams, client, prompt, api_prompt, use_cache, deadline
+        )
+        return
+    if script_requester:
+        try:
+            api_prompt = generate_requested_script(
+                prompt_customization=prompt_customizations[guest_type],
+                script_prompt=script_prompt,
+                scene_type=scene_type,
+            )
+            logger.info(f"Streaming direct OpenAI script for {api_prompt}")
+            script_rows = stream_cached(
+                use_cache,
+                "openai",
+                api_prompt,
+                partial(client.generate_real_openapi_stream, deadline=deadline),
+            )
+            first_row = next(script_rows)
+        except Exception as e:
+            # Only fall back if nothing was generated yet, otherwise lines would be duplicated
+            logger.exception(f"direct OpenAI generation failed due to {e}")
+            LLM_FALLBACKS.inc()
+        else:
+            yield first_row
+            yield from script_rows
+            return
+
+    yield from stream_cached(
+        use_cache, "local", prompt, partial(client.generate_stream, deadline=deadline)
+    )
+
+
+def encode_script_audio(cfg, redis_client, audio_clips):
+    payload_version = cfg["redis"].get("payload_version", 1)
+    if payload_version >= constants.BINARY_AUDIO_PAYLOAD_VERSION:
+        # Raw WAV bytes go into their own keys, the payload only carries references
+        blob_keys = redis_client.add_audio_blobs(
+            f"{constants.REDIS_AUDIO_BLOB_KEY_PREFIX}{uuid.uuid4()}",
+            audio_clips,
+            ttl=cfg["redis"].get(
+                "audio_blob_ttl", constants.DEFAULT_AUDIO_BLOB_TTL_SECONDS
+            ),
+        )
+        audio = [
+            {"key": blob_key, "bytes": len(audio_clip)}
+            for blob_key, audio_clip in zip(blob_keys, audio_clips)
+        ]
+    else:
+        audio = [
+            base64.b64encode(audio_clip).decode("ascii") for audio_clip in audio_clips
+        ]
+    return (payload_version, audio)
+
+
+def encode_audio_clip(cfg, redis_client, blob_key, audio_clip):
+    if cfg["redis"].get("payload_version", 1) >= constants.BINARY_AUDIO_PAYLOAD_VERSION:
+        redis_client.add_audio_blob(
+            blob_key,
+            audio_clip,
+            ttl=cfg["redis"].get(
+                "audio_blob_ttl", constants.DEFAULT_AUDIO_BLOB_TTL_SECONDS
+            ),
+        )
+        return {"key": blob_key, "bytes": len(audio_clip)}
+    return base64.b64encode(audio_clip).decode("ascii")
+
+
+def create_segment_publisher(
+    cfg, redis_client, guest_type, script_prompt, script_requester, scene_type
+):
+    if not cfg["redis"].get("segmented_publish"):
+        return None
+
+    script_id = uuid.uuid4()
+    header = {
+        "version": cfg["redis"].get("payload_version", 1),
+        "animation": [],
+        "audio": [],
+        "audioLayout": "segments",
+        "guestType": guest_type,
+        "prompt": script_prompt,
+        "requester": script_requester,
+        "sceneType": scene_type,
+    }
+    return SegmentPublisher(
+        redis_client,
+        queue=(
+            redis_client.requested_script_queue
+            if script_requester
+            else redis_client.script_queue
+        ),
+        segment_key=f"{constants.REDIS_SCRIPT_SEGMENTS_KEY_PREFIX}{script_id}",
+        header=header,
+        encode_audio=lambda index, audio_clip: encode_audio_clip(
+            cfg,
+            redis_client,
+            f"{constants.REDIS_AUDIO_BLOB_KEY_PREFIX}{script_id}:{index}",
+            audio_clip,
+        ),
+        ttl=cfg["redis"].get(
+            "audio_blob_ttl", constants.DEFAULT_AUDIO_BLOB_TTL_SECONDS
+        ),
+    )
+
+
+def build_script_payload(
+    cfg,
+    animation_sequence,
+    audio_clips,
+    script_metadata,
+    guest_type,
+    script_prompt,
+    script_requester,
+    scene_type,
+    encoded_audio=None,
+):
+    if encoded_audio is None:
+        (payload_version, audio) = encode_script_audio(cfg, redis_client, audio_clips)
+    else:
+        (payload_version, audio) = (
+            cfg["redis"].get("payload_version", 1),
+            encoded_audio,
+        )
+    return json.dumps(
+        {
+            "version": payload_version,
+            "animation": animation_sequence,
+            "audio": audio,
+            "audioLayout": script_metadata.get("audio_layout", "clips"),
+            "sampleRate": script_metadata.get("sample_rate"),
+            "guestGender": script_metadata["guest_gender"],
+            "guestType": guest_type,
+            "prompt": script_prompt,
+            "requester": script_requester,
+            "sceneType": scene_type,
+        }
+    )
+
+
+def publish_script(
+    redis_client,
+    payload,
+    script_requester,
+    script_prompt,
+    push_to_queue=True,
+    claimed_request=None,
+    merged_requesters=(),
+):
+    queue = None
+    request_response_payloads = []
+    if script_requester:
+        # If there's a requester, then we need to publish the result to twitch,
+        # and push into requested queue instead of the normal queue
+        queue = redis_client.requested_script_queue
+        request_response_payloads = [
+            json.dumps(
+                {
+                    "name": requester,
+                    "prompt": script_prompt,
+                    "success": True,
+                }
+            )
+            for requester in [script_requester, *merged_requesters]
+        ]
+    else:
+        queue = redis_client.script_queue
+    # Segmented scripts are already on the queue, only the full copy is kept as a backup
+    if not push_to_queue:
+        queue = None
+
+    SCRIPTS_PUBLISHED.inc(kind="requested" if script_requester else "auto")
+    return redis_client.publish_script(
+        payload,
+        queue=queue,
+        response_payloads=request_response_payloads,
+        backup_library=backup_library,
+        request_queue=request_queue,
+        claimed_request=claimed_request,
+    )
+
+
+def publish_failure(
+    redis_client,
+    script_requester,
+    script_prompt,
+    claimed_request=None,
+    merged_requesters=(),
+):
+    request_response_payloads = [
+        json.dumps(
+            {
+                "name": requester,
+                "prompt": script_prompt,
+                "success": False,
+            }
+        )
+        for requester in [script_requester, *merged_requesters]
+    ]
+    redis_client.publish_responses(
+        request_response_payloads,
+        request_queue=request_queue,
+        claimed_request=claimed_request,
+    )
 
 
 def do_generate_script(
@@ -104,154 +444,514 @@ def do_generate_script(
     script_requester=None,
     script_personality=None,
     scene_type="podcast",
+    stream=False,
+    claimed_request=None,
+    merged_requesters=(),
+    use_cache=False,
+    deadline=None,
 ):
-    global redis_script_key_counter
+    deadline = deadline or script_deadline(cfg)
+    segment_publisher = create_segment_publisher(
+        cfg, redis_client, guest_type, script_prompt, script_requester, scene_type
+    )
+    try:
+        if stream:
+            script_rows = stream_prompt(
+                client=chatgpt_client,
+                guest_type=guest_type,
+                script_prompt=script_prompt,
+                script_requester=script_requester,
+                guest_personality=script_personality,
+                scene_type=scene_type,
+                use_cache=use_cache,
+                deadline=deadline,
+            )
+            (animation_sequence, audio_clips, script_metadata) = render_streamed_script(
+                tts_client,
+                cfg,
+                script_rows,
+                guest_type=guest_type,
+                scene_type=scene_type,
+                segment_publisher=segment_publisher,
+                deadline=deadline,
+            )
+        else:
+            response = fetch_prompt(
+                client=chatgpt_client,
+                guest_type=guest_type,
+                script_prompt=script_prompt,
+                script_requester=script_requester,
+                guest_personality=script_personality,
+                scene_type=scene_type,
+                use_cache=use_cache,
+                deadline=deadline,
+            )
+            (animation_sequence, audio_clips, script_metadata) = generate_files(
+                tts_client=tts_client,
+                config=cfg,
+                script_rows=response,
+                guest_type=guest_type,
+                scene_type=scene_type,
+                segment_publisher=segment_publisher,
+                deadline=deadline,
+            )
+    except Exception:
+        if segment_publisher:
+            segment_publisher.fail()
+        raise
 
-    response = fetch_prompt(
-        client=chatgpt_client,
+    payload = build_script_payload(
+        cfg,
+        animation_sequence,
+        audio_clips,
+        script_metadata,
         guest_type=guest_type,
         script_prompt=script_prompt,
         script_requester=script_requester,
-        guest_personality=script_personality,
         scene_type=scene_type,
+        encoded_audio=segment_publisher.encoded_audio if segment_publisher else None,
     )
-    (animation_sequence, audio_base64, script_metadata) = generate_files(
-        tts_client=tts_client,
-        config=cfg,
-        csv_text=response,
-        guest_type=guest_type,
-        scene_type=scene_type,
+    return publish_script(
+        redis_client,
+        payload,
+        script_requester,
+        script_prompt,
+        push_to_queue=segment_publisher is None,
+        claimed_request=claimed_request,
+        merged_requesters=merged_requesters,
     )
-    payload = json.dumps(
-        {
-            "animation": animation_sequence,
-            "audio": audio_base64,
-            "guestGender": script_metadata["guest_gender"],
-            "guestType": guest_type,
-            "prompt": script_prompt,
-            "requester": script_requester,
-            "sceneType": scene_type,
-        }
+
+
+def refresh_script_audio(cfg, redis_client, payload):
+    script = json.loads(payload)
+    if script.get("version", 1) < constants.BINARY_AUDIO_PAYLOAD_VERSION:
+        return True
+    return redis_client.refresh_audio_blobs(
+        [audio["key"] for audio in script["audio"]],
+        ttl=cfg["redis"].get(
+            "audio_blob_ttl", constants.DEFAULT_AUDIO_BLOB_TTL_SECONDS
+        ),
     )
 
-    if script_requester:
-        # If there's a requester, then we need to publish the result to twitch,
-        # and push into requested queue instead of the normal queue
-        redis_client.push(payload, queue=redis_client.requested_script_queue)
-        request_response_payload = {
-            "name": script_requester,
-            "prompt": script_prompt,
-            "success": True,
-        }
-        redis_client.push(
-            json.dumps(request_response_payload),
-            redis_client.script_request_response_queue,
+
+def do_push_backup_script(cfg, redis_client, backup_library, buffer_controller):
+    global last_backup_push_time
+
+    script_length = redis_client.get_length()
+    buffer_controller.observe(script_length)
+    if not buffer_controller.needs_backup(script_length):
+        return
+    # Rate limited instead of sleeping, so a failover doesn't hold up the next script
+    if (
+        time.monotonic() - last_backup_push_time
+        < constants.BACKUP_PUSH_INTERVAL_SECONDS
+    ):
+        logger.info("pushed a backup script recently, skipping")
+        return
+
+    # If errored out and scripts are running low, pull a random backup script and load it
+    while True:
+        (script_id, payload) = backup_library.pick_random()
+        if not script_id:
+            logger.warning("no backup scripts available")
+            return
+        if payload and refresh_script_audio(cfg, redis_client, payload):
+            break
+        # Can't be played anymore, so drop it and try another
+        logger.warning(f"backup script {script_id} has expired, removing it")
+        backup_library.remove(script_id)
+    redis_client.push(payload)
+    SCRIPTS_PUBLISHED.inc(kind="backup")
+    buffer_controller.record_published(script_length + 1)
+    last_backup_push_time = time.monotonic()
+
+
+def next_script_job(
+    redis_client, request_queue, potential_auto_topics, buffer_controller, in_flight=0
+):
+    # Requests held by crashed workers go back on the queue, or get a failure reply
+    # once they've been retried too often
+    for dead_request in request_queue.reap_if_due():
+        try:
+            dead_request = json.loads(dead_request)
+            publish_failure(
+                redis_client,
+                dead_request["name"],
+                dead_request["prompt"],
+                merged_requesters=dead_request.get("merged", []),
+            )
+        except (ValueError, KeyError):
+            logger.exception(f"dropping malformed request {dead_request}")
+
+    (script_length, request) = request_queue.claim()
+    buffer_controller.observe(script_length)
+    # in_flight is how many scripts the pipeline is still generating
+    if not request and not buffer_controller.should_generate(script_length, in_flight):
+        # Nothing to fill, so block on the request queue instead of sleeping, a chat
+        # request wakes this straight away and the buffer gets checked again on timeout
+        logger.debug(
+            f"{script_length} scripts queued and {in_flight} in flight, "
+            f"target is {buffer_controller.target_depth()}, waiting for requests"
+        )
+        request = request_queue.wait_for_claim(
+            timeout=buffer_controller.wait_seconds(script_length, in_flight)
+        )
+        if not request:
+            return None
+        script_length = redis_client.get_length()
+        buffer_controller.observe(script_length)
+
+    claimed_request = request
+    merged_requesters = []
+    if request:
+        try:
+            request = json.loads(request)
+            script_prompt = request["prompt"]
+            script_type = request["type"]
+            script_requester = request["name"]
+            scene_type = request["scene_type"]
+            # Everyone else who asked for the same prompt while this one was pending
+            merged_requesters = request.get("merged", [])
+        except (ValueError, KeyError):
+            logger.exception(f"dropping malformed request {request}")
+            request_queue.ack(claimed_request)
+            return None
+        logger.info(
+            f"Generating requested {script_type} script with prompt {script_prompt}"
+        )
+    else:
+        if random.randint(0, 10) == 10:
+            script_prompt = (
+                constants.DEFAULT_GUEST_HOST_COMBATIVE_PROMPT_DISCUSSION_TOPIC
+            )
+        else:
+            script_prompt = random.choice(potential_auto_topics)
+        script_type = "normal"
+        script_requester = None
+        script_random_key_val = random.randint(0, 10)
+        if script_random_key_val == 10:
+            script_type = "skeleton"
+        elif script_random_key_val == 0:
+            script_type = "robot"
+        scene_type = "podcast"
+
+    return {
+        "started_at": time.monotonic(),
+        "claimed_request": claimed_request,
+        "merged_requesters": merged_requesters,
+        "guest_type": script_type,
+        "script_prompt": script_prompt,
+        "script_requester": script_requester,
+        "scene_type": scene_type,
+        "script_personality": (
+            "",
+            "",
+        ),  # random.choice(constants.RANDOM_GUEST_PERSONALITIES)
+    }
+
+
+def run_script_pipeline(
+    cfg, chatgpt_client, tts_client, potential_auto_topics, stream=False, fresh=False
+):
+    def use_cache(job):
+        # Auto filler always gets a fresh script, requests can be replayed
+        return not fresh and job["script_requester"] is not None
+
+    def generate_stage(job):
+        logger.info(f"generating script", extra={"timestamp": datetime.now()})
+        job["deadline"] = script_deadline(cfg, started_at=job["started_at"])
+        job["response"] = fetch_prompt(
+            client=chatgpt_client,
+            guest_type=job["guest_type"],
+            script_prompt=job["script_prompt"],
+            script_requester=job["script_requester"],
+            guest_personality=job["script_personality"],
+            scene_type=job["scene_type"],
+            use_cache=use_cache(job),
+            deadline=job["deadline"],
+        )
+        return job
+
+    def parse_stage(job):
+        check_deadline(job["deadline"], "parsing")
+        (job["script_lines"], job["guest_gender"]) = parse_script_lines(
+            job["response"], job["guest_type"]
+        )
+        return job
+
+    def tts_stage(job):
+        segment_publisher = create_job_segment_publisher(job)
+        try:
+            (animation_sequence, audio_clips, script_metadata) = render_script(
+                tts_client,
+                cfg,
+                job["script_lines"],
+                guest_type=job["guest_type"],
+                guest_gender=job["guest_gender"],
+                scene_type=job["scene_type"],
+                segment_publisher=segment_publisher,
+                deadline=job["deadline"],
+            )
+        except Exception:
+            if segment_publisher:
+                segment_publisher.fail()
+            raise
+        return build_job_payload(
+            job, animation_sequence, audio_clips, script_metadata, segment_publisher
+        )
+
+    last_stream = None
+
+    def streamed_llm_stage(job):
+        # The rows go to the TTS stage as they're generated, this stage only waits for
+        # the previous script's stream to end so there's one LLM request at a time
+        nonlocal last_stream
+        if last_stream:
+            last_stream.done.wait()
+        logger.info(f"generating script", extra={"timestamp": datetime.now()})
+        job["deadline"] = script_deadline(cfg, started_at=job["started_at"])
+        last_stream = job["stream"] = StreamHandoff(
+            lambda: stream_prompt(
+                client=chatgpt_client,
+                guest_type=job["guest_type"],
+                script_prompt=job["script_prompt"],
+                script_requester=job["script_requester"],
+                guest_personality=job["script_personality"],
+                scene_type=job["scene_type"],
+                use_cache=use_cache(job),
+                deadline=job["deadline"],
+            )
+        )
+        return job
+
+    def streamed_tts_stage(job):
+        segment_publisher = create_job_segment_publisher(job)
+        try:
+            (animation_sequence, audio_clips, script_metadata) = render_streamed_script(
+                tts_client,
+                cfg,
+                job["stream"].script_rows(),
+                guest_type=job["guest_type"],
+                scene_type=job["scene_type"],
+                segment_publisher=segment_publisher,
+                deadline=job["deadline"],
+            )
+        except Exception:
+            if segment_publisher:
+                segment_publisher.fail()
+            raise
+        finally:
+            # Stops the LLM stream if rendering gave up on it
+            job["stream"].cancel()
+        return build_job_payload(
+            job, animation_sequence, audio_clips, script_metadata, segment_publisher
+        )
+
+    def create_job_segment_publisher(job):
+        return create_segment_publisher(
+            cfg,
+            redis_client,
+            job["guest_type"],
+            job["script_prompt"],
+            job["script_requester"],
+            job["scene_type"],
         )
+
+    def build_job_payload(
+        job, animation_sequence, audio_clips, script_metadata, segment_publisher
+    ):
+        job["payload"] = build_script_payload(
+            cfg,
+            animation_sequence,
+            audio_clips,
+            script_metadata,
+            guest_type=job["guest_type"],
+            script_prompt=job["script_prompt"],
+            script_requester=job["script_requester"],
+            scene_type=job["scene_type"],
+            encoded_audio=(
+                segment_publisher.encoded_audio if segment_publisher else None
+            ),
+        )
+        job["segmented"] = segment_publisher is not None
+        return job
+
+    def publish_stage(job):
+        script_length = publish_script(
+            redis_client,
+            job["payload"],
+            job["script_requester"],
+            job["script_prompt"],
+            push_to_queue=not job["segmented"],
+            claimed_request=job["claimed_request"],
+            merged_requesters=job["merged_requesters"],
+        )
+        buffer_controller.record_published(script_length)
+        buffer_controller.record_generation(time.monotonic() - job["started_at"])
+        logger.info(
+            f"completed generation of script", extra={"timestamp": datetime.now()}
+        )
+
+    def on_error(stage_name, job, error):
+        logger.exception(f"{stage_name} stage failed due to error {error}")
+        SCRIPT_FAILURES.inc(stage=stage_name)
+        if job["script_requester"]:
+            publish_failure(
+                redis_client,
+                job["script_requester"],
+                job["script_prompt"],
+                claimed_request=job["claimed_request"],
+                merged_requesters=job["merged_requesters"],
+            )
+        do_push_backup_script(
+            cfg,
+            redis_client=redis_client,
+            backup_library=backup_library,
+            buffer_controller=buffer_controller,
+        )
+        # An open circuit breaker fails jobs instantly, don't spin the stage on them
+        time.sleep(
+            cfg.get("scheduler", {}).get(
+                "failure_backoff_seconds", constants.FAILURE_BACKOFF_SECONDS
+            )
+        )
+
+    if stream:
+        stages = [
+            ("llm", streamed_llm_stage),
+            ("tts", streamed_tts_stage),
+            ("publish", publish_stage),
+        ]
     else:
-        redis_client.push(payload)
+        stages = [
+            ("llm", generate_stage),
+            ("parse", parse_stage),
+            ("tts", tts_stage),
+            ("publish", publish_stage),
+        ]
+    script_pipeline = ScriptPipeline(
+        source=lambda: next_script_job(
+            redis_client,
+            request_queue,
+            potential_auto_topics,
+            buffer_controller,
+            in_flight=script_pipeline.in_flight(),
+        ),
+        stages=stages,
+        on_error=on_error,
+        queue_size=cfg.get("pipeline", {}).get("queue_size", 1),
+    )
+    script_pipeline.run_forever()
+
 
-    backup_script_key = f"{constants.REDIS_SCRIPT_KEY_PREFIX}{redis_script_key_counter}"
-    redis_client.add(backup_script_key, payload)
-    redis_script_key_counter += 1
-    if redis_script_key_counter % 30 == 0:
-        redis_script_key_counter = 0
+def setup_generator(cfg):
+    # Shared clients the functions above rely on, the benchmarks set them up through here too
+    global redis_client, backup_library, buffer_controller, request_queue, script_cache
+
+    redis_client = RedisClient(config=cfg)
+    backup_library = BackupScriptLibrary(redis_client, config=cfg)
+    if not backup_library.size():
+        backup_library.import_legacy_scripts()
+    buffer_controller = BufferController(config=cfg)
+    request_queue = ReliableRequestQueue(redis_client, config=cfg)
+    script_cache = ScriptCache(redis_client, config=cfg)
 
 
-def do_push_backup_script(script_length, redis_client):
-    if script_length < 10:
-        # If errored out and scripts are running low, pull a random backup script and load it
-        keys = redis_client.get_keys(f"{constants.REDIS_SCRIPT_KEY_PREFIX}*")[1]
-        key = random.choice(keys)
-        redis_client.push(redis_client.get(key))
-        # Since this takes less time then chatGPT, sleep for a bit longer so we don't buffer too many
-        # backups
-        time.sleep(10)
+def run_script_loop(
+    cfg, chatgpt_client, tts_client, potential_auto_topics, stream=False, fresh=False
+):
+    while True:
+        job = next_script_job(
+            redis_client,
+            request_queue,
+            potential_auto_topics,
+            buffer_controller,
+        )
+        if not job:
+            continue
+        try:
+            logger.info(f"generating script", extra={"timestamp": datetime.now()})
+            script_length = do_generate_script(
+                cfg,
+                chatgpt_client,
+                tts_client,
+                guest_type=job["guest_type"],
+                script_prompt=job["script_prompt"],
+                script_requester=job["script_requester"],
+                script_personality=job["script_personality"],
+                scene_type=job["scene_type"],
+                stream=stream,
+                claimed_request=job["claimed_request"],
+                merged_requesters=job["merged_requesters"],
+                use_cache=not fresh and job["script_requester"] is not None,
+                deadline=script_deadline(cfg, started_at=job["started_at"]),
+            )
+            buffer_controller.record_published(script_length)
+            buffer_controller.record_generation(time.monotonic() - job["started_at"])
+            logger.info(
+                f"completed generation of script",
+                extra={"timestamp": datetime.now()},
+            )
+        except Exception as error:
+            logger.exception(f"generation failed due to error {error}")
+            SCRIPT_FAILURES.inc(stage="generate")
+            if job["script_requester"]:
+                publish_failure(
+                    redis_client,
+                    job["script_requester"],
+                    job["script_prompt"],
+                    claimed_request=job["claimed_request"],
+                    merged_requesters=job["merged_requesters"],
+                )
+            do_push_backup_script(
+                cfg,
+                redis_client=redis_client,
+                backup_library=backup_library,
+                buffer_controller=buffer_controller,
+            )
+            # Don't spin on a backend that's failing fast
+            time.sleep(
+                cfg.get("scheduler", {}).get(
+                    "failure_backoff_seconds", constants.FAILURE_BACKOFF_SECONDS
+                )
+            )
 
 
 if __name__ == "__main__":
     with open("config.json", "r") as json_file:
         cfg = json.loads(json_file.read())
 
-    redis_client = RedisClient(config=cfg)
+    setup_generator(cfg)
+    metrics.start_from_config(cfg, "generator", redis_client=redis_client)
     chatgpt_client = ChatGPTClient(config=cfg)
     tts_client = TTSClient(config=cfg)
     args = parser.parse_args()
 
     if args.infinite:
+        request_queue.start()
         potential_auto_topics = [
             constants.DEFAULT_HUMEROUS_PROMPT_DISCUSSION_TOPIC,
             constants.DEFAULT_PROMPT_DISCUSSION_TOPIC,
         ]
 
-        while True:
-            script_length = redis_client.get_length()
-
-            request = redis_client.get_queue_content(redis_client.script_request_queue)
-            if not request and script_length > 60:
-                logger.debug("too many queued scripts already, skipping")
-                time.sleep(5)
-                continue
-            try:
-                if request:
-                    request = json.loads(request)
-                    script_prompt = request["prompt"]
-                    script_type = request["type"]
-                    script_requester = request["name"]
-                    scene_type = request["scene_type"]
-                    logger.info(
-                        f"Generating requested {script_type} script with prompt {script_prompt}"
-                    )
-                else:
-                    if random.randint(0, 10) == 10:
-                        script_prompt = (
-                            constants.DEFAULT_GUEST_HOST_COMBATIVE_PROMPT_DISCUSSION_TOPIC
-                        )
-                    else:
-                        script_prompt = random.choice(potential_auto_topics)
-                    script_type = "normal"
-                    script_requester = None
-                    script_random_key_val = random.randint(0, 10)
-                    if script_random_key_val == 10:
-                        script_type = "skeleton"
-                    elif script_random_key_val == 0:
-                        script_type = "robot"
-                    scene_type = "podcast"
-                logger.info(f"generating script", extra={"timestamp": datetime.now()})
-                script_guest_personality = (
-                    "",
-                    "",
-                )  # random.choice(constants.RANDOM_GUEST_PERSONALITIES)
-                do_generate_script(
-                    cfg,
-                    chatgpt_client,
-                    tts_client,
-                    guest_type=script_type,
-                    script_prompt=script_prompt,
-                    script_requester=script_requester,
-                    script_personality=script_guest_personality,
-                    scene_type=scene_type,
-                )
-                logger.info(
-                    f"completed generation of script",
-                    extra={"timestamp": datetime.now()},
-                )
-            except Exception as error:
-                logger.exception(f"generation failed due to error {error}")
-                if request:
-                    request_response_payload = {
-                        "name": script_requester,
-                        "prompt": script_prompt,
-                        "success": False,
-                    }
-                    redis_client.push(
-                        json.dumps(request_response_payload),
-                        redis_client.script_request_response_queue,
-                    )
-                do_push_backup_script(
-                    script_length=script_length, redis_client=redis_client
-                )
-
-            time.sleep(20)
+        if args.pipeline:
+            run_script_pipeline(
+                cfg,
+                chatgpt_client,
+                tts_client,
+                potential_auto_topics,
+                stream=args.stream,
+                fresh=args.fresh,
+            )
+        else:
+            run_script_loop(
+                cfg,
+                chatgpt_client,
+                tts_client,
+                potential_auto_topics,
+                stream=args.stream,
+                fresh=args.fresh,
+            )
     elif args.test_request:
         script_prompt = args.test_request
         script_type = args.type
@@ -264,6 +964,8 @@ if __name__ == "__main__":
             script_prompt=script_prompt,
             script_requester=script_requester,
             script_personality=random.choice(constants.RANDOM_GUEST_PERSONALITIES),
+            stream=args.stream,
+            use_cache=not args.fresh,
         )
     elif args.test_rap_battle_request:
         script_prompt = args.test_rap_battle_request
@@ -278,6 +980,8 @@ if __name__ == "__main__":
             script_requester=script_requester,
             script_personality=random.choice(constants.RANDOM_GUEST_PERSONALITIES),
             scene_type="rapbattle",
+            stream=args.stream,
+            use_cache=not args.fresh,
         )
     elif args.test_business_talk_request:
         script_prompt = args.test_business_talk_request
@@ -292,9 +996,13 @@ if __name__ == "__main__":
             script_requester=script_requester,
             script_personality=random.choice(constants.RANDOM_GUEST_PERSONALITIES),
             scene_type="businesstalk",
+            stream=args.stream,
+            use_cache=not args.fresh,
         )
     elif args.request:
-        request = redis_client.get_queue_content(redis_client.script_request_queue)
+        request_queue.start()
+        (_, claimed_request) = request_queue.claim()
+        request = claimed_request
         if not request:
             logger.warning("No request found, returning")
         else:
@@ -302,6 +1010,7 @@ if __name__ == "__main__":
             script_prompt = request["prompt"]
             script_type = request["type"]
             script_requester = request["name"]
+            merged_requesters = request.get("merged", [])
             try:
                 do_generate_script(
                     cfg,
@@ -313,17 +1022,19 @@ if __name__ == "__main__":
                     script_personality=random.choice(
                         constants.RANDOM_GUEST_PERSONALITIES
                     ),
+                    stream=args.stream,
+                    claimed_request=claimed_request,
+                    merged_requesters=merged_requesters,
+                    use_cache=not args.fresh,
                 )
             except Exception as error:
                 logger.error(f"generation failed due to {error}")
-                request_response_payload = {
-                    "name": script_requester,
-                    "prompt": script_prompt,
-                    "success": False,
-                }
-                redis_client.push(
-                    json.dumps(request_response_payload),
-                    redis_client.script_request_response_queue,
+                publish_failure(
+                    redis_client,
+                    script_requester,
+                    script_prompt,
+                    claimed_request=claimed_request,
+                    merged_requesters=merged_requesters,
                 )
     else:
         logger.info(f"generating script", extra={"timestamp": datetime.now()})
@@ -333,4 +1044,5 @@ if __name__ == "__main__":
             tts_client,
             args.type,
             script_personality=random.choice(constants.RANDOM_GUEST_PERSONALITIES),
+            stream=args.stream,
         )
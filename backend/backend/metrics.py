@@ -0,0 +1,260 @@
+import bisect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger()
+
+# Seconds, wide enough for a Redis round trip up to a full LLM call
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+DEFAULT_SNAPSHOT_INTERVAL_SECONDS = 30
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ""
+    rendered = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in label_key
+    )
+    return f"{{{rendered}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., over the last bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 3)
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        # Failed calls get recorded too, so slow failures show up in the latency
+        tm1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - tm1, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, state in self.values.items():
+                cumulative = 0
+                for bucket, count in zip(self.buckets, state):
+                    cumulative += count
+                    samples.append(
+                        (f"{self.name}_bucket", key + (("le", bucket),), cumulative)
+                    )
+                samples.append(
+                    (f"{self.name}_bucket", key + (("le", "+Inf"),), state[-1])
+                )
+                samples.append((f"{self.name}_sum", key, state[-2]))
+                samples.append((f"{self.name}_count", key, state[-1]))
+        return samples
+
+
+# Holds every metric of the process. Metrics are created once at import time by the
+# modules that record them, then rendered in the Prometheus text format for the
+# endpoint, or as JSON for the Redis snapshots.
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric_type, name, help_text, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_type(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, label_key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(label_key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: [
+                {"name": name, "labels": dict(label_key), "value": value}
+                for name, label_key, value in metric.samples()
+            ]
+            for metric in metrics
+        }
+
+
+registry = MetricsRegistry()
+
+
+def counter(name, help_text):
+    return registry.counter(name, help_text)
+
+
+def gauge(name, help_text):
+    return registry.gauge(name, help_text)
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return registry.histogram(name, help_text, buckets=buckets)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    logger.info(f"serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def snapshot_key(process_name):
+    return f"metrics:{process_name}:{socket.gethostname()}:{os.getpid()}"
+
+
+def snapshot_payload(process_name):
+    return json.dumps(
+        {
+            "process": process_name,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "timestamp": time.time(),
+            "metrics": registry.snapshot(),
+        }
+    )
+
+
+def start_redis_snapshots(redis_client, process_name, interval):
+    # Snapshots expire if the process goes away, so stale ones don't linger
+    def publish_snapshots():
+        while True:
+            try:
+                redis_client.redis_client.set(
+                    snapshot_key(process_name),
+                    snapshot_payload(process_name),
+                    ex=int(interval * 3),
+                )
+            except Exception:
+                logger.exception("failed to publish metrics snapshot")
+            time.sleep(interval)
+
+    threading.Thread(
+        target=publish_snapshots, name="metrics-snapshots", daemon=True
+    ).start()
+
+
+def start_from_config(config, process_name, redis_client=None):
+    # The endpoint is opt in through metrics.<process>_port, snapshots go to Redis every
+    # metrics.snapshot_interval_seconds unless that's set to 0
+    metrics_cfg = config.get("metrics", {})
+    port = metrics_cfg.get(f"{process_name}_port")
+    if port:
+        start_http_server(port, host=metrics_cfg.get("host", "127.0.0.1"))
+    interval = metrics_cfg.get(
+        "snapshot_interval_seconds", DEFAULT_SNAPSHOT_INTERVAL_SECONDS
+    )
+    if redis_client is not None and interval:
+        start_redis_snapshots(redis_client, process_name, interval)
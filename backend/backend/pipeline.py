@@ -0,0 +1,203 @@
+import logging
+import queue
+import threading
+import metrics
+
+logger = logging.getLogger()
+
+STAGE_SECONDS = metrics.histogram(
+    "pipeline_stage_seconds", "Time a job spends in each pipeline stage"
+)
+
+# Marker passed down the stage queues to shut the pipeline down in order
+_STOP = object()
+
+
+# A single stage of the script pipeline, runs the handler on each job from the inbox
+# and hands the result to the outbox. One thread per stage reading a FIFO queue,
+# so jobs leave the pipeline in the same order they entered it.
+class PipelineStage(threading.Thread):
+    def __init__(self, name, handler, inbox, outbox, on_error, on_finished=None):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage_name = name
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        # Called once a job leaves the pipeline: published, dropped or failed
+        self.on_finished = on_finished or (lambda: None)
+
+    def run(self):
+        while True:
+            job = self.inbox.get()
+            if job is _STOP:
+                if self.outbox is not None:
+                    self.outbox.put(_STOP)
+                return
+            self._process(job)
+
+    def _process(self, job):
+        try:
+            with STAGE_SECONDS.time(stage=self.stage_name):
+                result = self.handler(job)
+        except Exception as error:
+            self.on_finished()
+            self.on_error(self.stage_name, job, error)
+            return
+        if result is not None and self.outbox is not None:
+            # Blocks when the next stage is still busy, which keeps the earlier
+            # stages from racing too far ahead
+            self.outbox.put(result)
+        else:
+            self.on_finished()
+
+
+# First stage of the pipeline, pulls from the source instead of a queue so the next
+# job is only picked once this stage is actually free to work on it
+class SourceStage(PipelineStage):
+    def __init__(
+        self,
+        name,
+        source,
+        handler,
+        outbox,
+        on_error,
+        stop_event,
+        on_started,
+        on_finished,
+    ):
+        super().__init__(name, handler, None, outbox, on_error, on_finished)
+        self.source = source
+        self.stop_event = stop_event
+        self.on_started = on_started
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                job = self.source()
+            except Exception as error:
+                logger.exception(f"pipeline source failed due to {error}")
+                self.stop_event.wait(5)
+                continue
+            if job is None:
+                continue
+            self.on_started()
+            self._process(job)
+        if self.outbox is not None:
+            self.outbox.put(_STOP)
+
+
+# Reads a stream on its own thread, so one stage can start it and hand the job on while
+# the next stage consumes the rows as they're generated. done is set once the stream
+# has ended, failed or been cancelled by the consumer giving up on it.
+class StreamHandoff:
+    def __init__(self, open_stream, name="pipeline-stream"):
+        self.rows = queue.Queue()
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        threading.Thread(
+            target=self._run, args=(open_stream,), name=name, daemon=True
+        ).start()
+
+    def _run(self, open_stream):
+        stream = None
+        try:
+            stream = open_stream()
+            for row in stream:
+                if self.cancelled.is_set():
+                    break
+                self.rows.put((row, None))
+            self.rows.put((_STOP, None))
+        except Exception as error:
+            self.rows.put((_STOP, error))
+        finally:
+            # Closes the stream from the thread that's reading it
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            self.done.set()
+
+    def script_rows(self):
+        try:
+            while True:
+                (row, error) = self.rows.get()
+                if error is not None:
+                    raise error
+                if row is _STOP:
+                    return
+                yield row
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        # The stream stops at its next row
+        self.cancelled.set()
+
+
+# Stages are joined by bounded queues so the LLM can generate the next script while
+# the TTS server renders the current one. stages is a list of (name, handler), each
+# handler returns the job for the next stage (or None to drop it). source returns the
+# next job for the first stage, or None if there's nothing to do yet.
+class ScriptPipeline:
+    def __init__(self, source, stages, on_error, queue_size=1):
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.jobs_in_flight = 0
+        queues = [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+
+        first_name, first_handler = stages[0]
+        self.stages = [
+            SourceStage(
+                first_name,
+                source,
+                first_handler,
+                queues[0] if queues else None,
+                on_error,
+                self.stop_event,
+                self._job_started,
+                self._job_finished,
+            )
+        ]
+        for index, (name, handler) in enumerate(stages[1:]):
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            self.stages.append(
+                PipelineStage(
+                    name, handler, queues[index], outbox, on_error, self._job_finished
+                )
+            )
+
+    def _job_started(self):
+        with self.lock:
+            self.jobs_in_flight += 1
+
+    def _job_finished(self):
+        with self.lock:
+            self.jobs_in_flight -= 1
+
+    def in_flight(self):
+        # Jobs picked from the source that haven't been published, dropped or failed yet
+        with self.lock:
+            return self.jobs_in_flight
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        # In flight jobs are allowed to drain through the rest of the stages
+        self.stop_event.set()
+
+    def join(self):
+        for stage in self.stages:
+            stage.join()
+
+    def run_forever(self):
+        self.start()
+        try:
+            # Join with a timeout so KeyboardInterrupt can still get through
+            while any(stage.is_alive() for stage in self.stages):
+                for stage in self.stages:
+                    stage.join(timeout=1)
+        except KeyboardInterrupt:
+            logger.info("stopping pipeline, waiting for in flight scripts")
+            self.stop()
+            self.join()
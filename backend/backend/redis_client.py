@@ -1,14 +1,37 @@
 import redis
 import logging
+import metrics
 
 logger = logging.getLogger()
 
+REDIS_OP_SECONDS = metrics.histogram(
+    "redis_op_seconds", "Latency of Redis round trips by operation"
+)
+
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_SOCKET_CONNECT_TIMEOUT = 5
+
 
 class RedisClient:
     def __init__(self, config):
-        self.redis_client = redis.Redis(
-            host=config["redis"]["host"], port=config["redis"]["port"] or 6379
+        # Shared by every thread of the generator, idle connections get pinged before reuse
+        self.connection_pool = redis.ConnectionPool(
+            host=config["redis"]["host"],
+            port=config["redis"]["port"] or 6379,
+            max_connections=config["redis"].get(
+                "max_connections", DEFAULT_MAX_CONNECTIONS
+            ),
+            health_check_interval=config["redis"].get(
+                "health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL
+            ),
+            socket_connect_timeout=config["redis"].get(
+                "socket_connect_timeout", DEFAULT_SOCKET_CONNECT_TIMEOUT
+            ),
+            socket_keepalive=True,
+            retry_on_timeout=True,
         )
+        self.redis_client = redis.Redis(connection_pool=self.connection_pool)
         self.script_queue = config["redis"]["job_queue"]
         self.requested_script_queue = config["redis"]["requested_job_queue"]
         self.script_request_queue = config["redis"]["request_queue"]
@@ -32,6 +55,53 @@ class RedisClient:
 
         self.redis_client.rpush(queue, str(payload))
 
+    def publish_script(
+        self,
+        payload,
+        queue=None,
+        response_payloads=(),
+        response_queue=None,
+        backup_library=None,
+        request_queue=None,
+        claimed_request=None,
+    ):
+        # Queue entry, request acknowledgement, backup copy and claim release all land in one
+        # MULTI/EXEC, so a crash can't leave only some of them written. Returns the script
+        # queue length.
+        pipeline = self.redis_client.pipeline(transaction=True)
+        if queue:
+            pipeline.lpush(queue, str(payload))
+        for response_payload in response_payloads:
+            pipeline.lpush(
+                response_queue or self.script_request_response_queue,
+                str(response_payload),
+            )
+        if backup_library:
+            backup_library.add(payload, client=pipeline)
+        if claimed_request:
+            request_queue.ack(claimed_request, client=pipeline)
+        pipeline.llen(self.script_queue)
+        with REDIS_OP_SECONDS.time(op="publish_script"):
+            return pipeline.execute()[-1]
+
+    def publish_responses(
+        self,
+        response_payloads,
+        response_queue=None,
+        request_queue=None,
+        claimed_request=None,
+    ):
+        pipeline = self.redis_client.pipeline(transaction=True)
+        for response_payload in response_payloads:
+            pipeline.lpush(
+                response_queue or self.script_request_response_queue,
+                str(response_payload),
+            )
+        if claimed_request:
+            request_queue.ack(claimed_request, client=pipeline)
+        with REDIS_OP_SECONDS.time(op="publish_responses"):
+            pipeline.execute()
+
     def get_queue_content(self, queue=None):
         queue = queue or self.script_queue
         content = self.redis_client.rpop(queue)
@@ -62,3 +132,35 @@ class RedisClient:
 
     def get_keys(self, search_string):
         return self.redis_client.scan(0, search_string, count=50)
+
+    def add_audio_blobs(self, key_prefix, audio_clips, ttl=None):
+        keys = [f"{key_prefix}:{index}" for index in range(len(audio_clips))]
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key, audio_clip in zip(keys, audio_clips):
+            pipeline.set(key, audio_clip, ex=ttl)
+        pipeline.execute()
+        return keys
+
+    def add_audio_blob(self, key, audio_clip, ttl=None):
+        self.redis_client.set(key, audio_clip, ex=ttl)
+        return key
+
+    def get_audio_blobs(self, keys):
+        return self.redis_client.mget(keys)
+
+    def refresh_audio_blobs(self, keys, ttl=None):
+        # Returns False if any of the blobs has already expired
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            if ttl:
+                pipeline.expire(key, ttl)
+            else:
+                pipeline.exists(key)
+        return all(pipeline.execute())
+
+    def append_segment(self, key, payload, ttl=None):
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.rpush(key, str(payload))
+        if ttl:
+            pipeline.expire(key, ttl)
+        pipeline.execute()
@@ -0,0 +1,160 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from redis_client import REDIS_OP_SECONDS
+
+from fair_scheduler import DISPATCH_REQUESTS, FairQueueKeys
+
+logger = logging.getLogger()
+
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_DELIVERIES = 3
+
+# KEYS: workers set, pending queue, attempts hash, dead letter list
+# ARGV: processing list prefix, heartbeat key prefix, max deliveries
+REAP_EXPIRED_WORKERS = """
+local dead = {}
+for _, worker in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    if redis.call("EXISTS", ARGV[2] .. worker) == 0 then
+        local processing = ARGV[1] .. worker
+        local request = redis.call("RPOP", processing)
+        while request do
+            if redis.call("HINCRBY", KEYS[3], request, 1) >= tonumber(ARGV[3]) then
+                redis.call("HDEL", KEYS[3], request)
+                redis.call("LPUSH", KEYS[4], request)
+                table.insert(dead, request)
+            else
+                -- Back onto the consuming end, so it's picked up before newer requests
+                redis.call("RPUSH", KEYS[2], request)
+            end
+            request = redis.call("RPOP", processing)
+        end
+        redis.call("SREM", KEYS[1], worker)
+    end
+end
+return dead
+"""
+
+
+# Claim/ack work queue on top of the ready list the fair scheduler dispatches to. Claimed
+# requests are moved atomically onto a processing list owned by this worker, and only
+# removed once their result (or failure) is published. Each worker holds a lease that a
+# background thread keeps renewing. When a worker dies its lease runs out and any worker
+# puts the requests it was holding back on the queue, up to max_deliveries times, so
+# any number of generator processes can share the queue without losing requests.
+class ReliableRequestQueue:
+    def __init__(self, redis_client, config, worker_id=None):
+        self.redis_client = redis_client
+        self.lease_seconds = config["redis"].get(
+            "request_lease_seconds", DEFAULT_LEASE_SECONDS
+        )
+        self.max_deliveries = config["redis"].get(
+            "max_request_deliveries", DEFAULT_MAX_DELIVERIES
+        )
+        self.worker_id = (
+            worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+
+        self.queue = redis_client.script_request_queue
+        self.workers_key = f"{self.queue}:workers"
+        self.attempts_key = f"{self.queue}:attempts"
+        self.dead_letter_queue = f"{self.queue}:dead"
+        self.processing_prefix = f"{self.queue}:processing:"
+        self.heartbeat_prefix = f"{self.queue}:heartbeat:"
+        self.processing_queue = f"{self.processing_prefix}{self.worker_id}"
+        self.heartbeat_key = f"{self.heartbeat_prefix}{self.worker_id}"
+
+        self.fair_keys = FairQueueKeys(self.queue, config)
+
+        self.reap_script = redis_client.redis_client.register_script(
+            REAP_EXPIRED_WORKERS
+        )
+        self.dispatch_script = redis_client.redis_client.register_script(
+            DISPATCH_REQUESTS
+        )
+        self.last_reap_time = 0
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def start(self):
+        self.renew_lease()
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat, name="request-queue-heartbeat", daemon=True
+        )
+        self.heartbeat_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def renew_lease(self):
+        # Also re-registers the worker, in case a slow renewal let it get reaped
+        pipeline = self.redis_client.redis_client.pipeline(transaction=True)
+        pipeline.set(self.heartbeat_key, self.worker_id, ex=self.lease_seconds)
+        pipeline.sadd(self.workers_key, self.worker_id)
+        pipeline.execute()
+
+    def _heartbeat(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            try:
+                self.renew_lease()
+            except Exception:
+                logger.exception(f"failed to renew lease for {self.worker_id}")
+
+    def dispatch(self, client=None):
+        # Tops up the ready queue from the per requester queues, in fair order
+        return self.dispatch_script(
+            keys=self.fair_keys.keys(),
+            args=self.fair_keys.dispatch_args(),
+            client=client,
+        )
+
+    def claim(self, length_queue=None):
+        # Claims the next request along with the length of another queue in one round trip
+        pipeline = self.redis_client.redis_client.pipeline(transaction=False)
+        pipeline.llen(length_queue or self.redis_client.script_queue)
+        self.dispatch(client=pipeline)
+        pipeline.lmove(self.queue, self.processing_queue, "RIGHT", "LEFT")
+        self.dispatch(client=pipeline)
+        with REDIS_OP_SECONDS.time(op="claim"):
+            (length, _, request, _) = pipeline.execute()
+        return (length, request.decode("utf-8") if request else None)
+
+    def wait_for_claim(self, timeout):
+        # Blocks until a request is pushed, or returns None after timeout seconds
+        request = self.redis_client.redis_client.blmove(
+            self.queue, self.processing_queue, timeout, "RIGHT", "LEFT"
+        )
+        if request:
+            self.dispatch()
+        return request.decode("utf-8") if request else None
+
+    def ack(self, request, client=None):
+        # Pass a pipeline as the client to make this part of a larger transaction
+        client = client or self.redis_client.redis_client
+        client.lrem(self.processing_queue, 1, request)
+        client.hdel(self.attempts_key, request)
+
+    def reap_expired_workers(self):
+        # Returns the requests that ran out of deliveries, they need a failure reply
+        self.last_reap_time = time.monotonic()
+        dead_requests = self.reap_script(
+            keys=[
+                self.workers_key,
+                self.queue,
+                self.attempts_key,
+                self.dead_letter_queue,
+            ],
+            args=[self.processing_prefix, self.heartbeat_prefix, self.max_deliveries],
+        )
+        if dead_requests:
+            logger.warning(f"gave up on {len(dead_requests)} redelivered requests")
+        return [request.decode("utf-8") for request in dead_requests]
+
+    def reap_if_due(self):
+        if time.monotonic() - self.last_reap_time < self.lease_seconds / 2:
+            return []
+        return self.reap_expired_workers()
@@ -0,0 +1,91 @@
+import constants
+import hashlib
+import json
+import logging
+import metrics
+import time
+
+from script_model import ScriptLine
+
+logger = logging.getLogger()
+
+SCRIPT_CACHE_LOOKUPS = metrics.counter(
+    "script_cache_lookups_total", "Script cache lookups by result"
+)
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_ENTRY_BYTES = 64 * 1024
+
+# KEYS: index zset
+# ARGV: key, script, timestamp, ttl, max entries
+PUT_CACHED_SCRIPT = """
+redis.call("SET", ARGV[1], ARGV[2], "EX", ARGV[4])
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", tonumber(ARGV[3]) - tonumber(ARGV[4]))
+local excess = redis.call("ZCARD", KEYS[1]) - tonumber(ARGV[5])
+if excess > 0 then
+    local evicted = redis.call("ZPOPMIN", KEYS[1], excess)
+    for index = 1, #evicted, 2 do
+        redis.call("DEL", evicted[index])
+    end
+end
+return excess
+"""
+
+
+def script_cache_key(source, prompt):
+    return hashlib.sha256(f"{source}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+# Parsed scripts keyed on the fully rendered prompt (and which model it went to), so
+# replays of the same request skip the LLM call. Lives in Redis so it's shared between
+# generator processes and one-off test runs. Entries expire after ttl seconds and the
+# oldest are evicted past max_entries.
+class ScriptCache:
+    def __init__(self, redis_client, config):
+        self.redis_client = redis_client
+        self.ttl = config["redis"].get("script_cache_ttl", DEFAULT_TTL_SECONDS)
+        self.max_entries = config["redis"].get(
+            "script_cache_max_entries", DEFAULT_MAX_ENTRIES
+        )
+        self.max_entry_bytes = config["redis"].get(
+            "script_cache_max_entry_bytes", DEFAULT_MAX_ENTRY_BYTES
+        )
+        self.index_key = f"{constants.REDIS_SCRIPT_CACHE_KEY_PREFIX}index"
+        self.put_script = redis_client.redis_client.register_script(PUT_CACHED_SCRIPT)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _key(self, source, prompt):
+        return f"{constants.REDIS_SCRIPT_CACHE_KEY_PREFIX}{script_cache_key(source, prompt)}"
+
+    def get(self, source, prompt):
+        if not self.enabled:
+            return None
+        cached = self.redis_client.redis_client.get(self._key(source, prompt))
+        SCRIPT_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+        if not cached:
+            return None
+        logger.info(f"using cached {source} script")
+        return [ScriptLine.from_fields(*fields) for fields in json.loads(cached)]
+
+    def put(self, source, prompt, script_lines):
+        # Too short to render, so it'd just fail again on every replay
+        if not self.enabled or not script_lines or len(script_lines) < 2:
+            return
+        script = json.dumps([script_line.to_fields() for script_line in script_lines])
+        if len(script) > self.max_entry_bytes:
+            return
+        self.put_script(
+            keys=[self.index_key],
+            args=[
+                self._key(source, prompt),
+                script,
+                time.time(),
+                self.ttl,
+                self.max_entries,
+            ],
+        )
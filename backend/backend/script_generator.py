@@ -1,20 +1,27 @@
-import csv
-import constants
 import concurrent.futures
 import time
 import logging
-import unidecode
 import random
+import metrics
 
+from audio_utils import stitch_wav_clips
+from deadlines import script_deadline
 from functools import partial
-from io import StringIO
 
 logger = logging.getLogger()
 
+SCRIPT_TTS_SECONDS = metrics.histogram(
+    "script_tts_seconds", "Time to render every line of a script"
+)
+FIRST_LINE_SECONDS = metrics.histogram(
+    "script_first_line_seconds",
+    "Time from starting a streamed script to its first rendered line",
+)
+DROPPED_LINES = metrics.counter(
+    "script_dropped_lines_total", "Script lines left out because their TTS failed"
+)
 
-def get_script_component_text(component):
-    retrieved_str = component.get("text")
-    return str(retrieved_str).strip() if retrieved_str else None
+DEFAULT_MAX_DROPPED_LINE_SHARE = 0.25
 
 
 def get_gender(guest_gender_str, script_type):
@@ -55,137 +62,346 @@ def _build_voice_map(config):
     return (voices, speeds)
 
 
+def assign_voices(
+    config,
+    script_lines,
+    voices,
+    speeds,
+    script_type="normal",
+    guest_gender=None,
+    scene_type=None,
+):
+    guest_voice = script_type if script_type == "robot" else guest_gender
+    speed_modifier = config["tts"]["scene_type_modifier"].get(scene_type, 1)
+    for script_line in script_lines:
+        voice = "host" if script_line.is_host else guest_voice
+        script_line.voice = voices[voice]
+        script_line.speed = speeds[voice] * speed_modifier
+
+
+def build_script_client_call(script_line, tts_client, save_file=False, deadline=None):
+    return partial(
+        tts_client.generate_tts_audio,
+        text=script_line.text,
+        voice=script_line.voice,
+        save_file=save_file,
+        speed=script_line.speed,
+        deadline=deadline,
+    )
+
+
 def build_script_client_calls(
     config,
-    script_components,
+    script_lines,
     tts_client,
     script_type="normal",
     save_file=False,
     guest_gender=None,
     scene_type=None,
+    deadline=None,
 ):
-    client_calls = []
     voices, speeds = _build_voice_map(config)
     logger.info(f"Using voices {voices}")
-    for script_component in script_components:
-        text = get_script_component_text(script_component)
+    assign_voices(
+        config,
+        script_lines,
+        voices,
+        speeds,
+        script_type=script_type,
+        guest_gender=guest_gender,
+        scene_type=scene_type,
+    )
+    return [
+        build_script_client_call(
+            script_line, tts_client, save_file=save_file, deadline=deadline
+        )
+        for script_line in script_lines
+    ]
 
-        text = text.strip().strip('"').strip("'").strip()
 
-        is_host = (
-            constants.DEFAULT_NAME.lower() in script_component["name"].lower()
-            or "poe" in script_component["name"].lower()
-        )
-        if is_host:
-            voice = voices["host"]
-            speed = speeds["host"]
+def generate_animation_entry(script_line, is_last=False):
+    if is_last:
+        return {
+            "camera": 0,
+            "characterPose": [0, 0],
+            "length": 1,
+            "text": script_line.text,
+        }
+
+    if script_line.is_host:
+        camera = 1
+        character_pose = [1, 0]
+    else:
+        camera = 2
+        character_pose = [0, 1]
+
+    return {
+        "camera": camera,
+        "characterPose": character_pose,
+        # This used to be a real value, stub in one and retrieve from files instead
+        "length": 1,
+        "text": script_line.text,
+    }
+
+
+def generate_animation_file(script_lines):
+    last_index = len(script_lines) - 1
+    return [
+        generate_animation_entry(script_line, is_last=index == last_index)
+        for index, script_line in enumerate(script_lines)
+    ]
+
+
+def stitch_script_audio(animation_script, audio_clips, script_metadata):
+    try:
+        (track, clip_timings, sample_rate) = stitch_wav_clips(audio_clips)
+    except Exception as e:
+        logger.warning(f"unable to stitch audio, sending separate clips instead: {e}")
+        return audio_clips
+
+    for animation, (offset, sample_count) in zip(animation_script, clip_timings):
+        animation["offset"] = offset
+        animation["samples"] = sample_count
+        animation["length"] = sample_count / sample_rate
+    script_metadata["audio_layout"] = "stitched"
+    script_metadata["sample_rate"] = sample_rate
+    return [track]
+
+
+def wait_for_audio(futures, deadline):
+    # Lines still queued at the deadline are cancelled, running ones stop retrying on
+    # their own, so a failed or cancelled line comes back as None instead of raising
+    concurrent.futures.wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in futures:
+        future.cancel()
+    concurrent.futures.wait(futures)
+
+    audio_clips = []
+    for index, future in enumerate(futures):
+        if future.cancelled():
+            logger.warning(f"line {index} missed the script deadline")
+            audio_clips.append(None)
+        elif future.exception():
+            logger.warning(f"line {index} failed TTS: {future.exception()}")
+            audio_clips.append(None)
         else:
-            voice = (
-                voices[guest_gender] if script_type != "robot" else voices[script_type]
-            )
-            speed = (
-                speeds[guest_gender] if script_type != "robot" else speeds[script_type]
-            )
+            audio_clips.append(future.result()[1])
+    return audio_clips
 
-        if scene_type in config["tts"]["scene_type_modifier"]:
-            speed *= config["tts"]["scene_type_modifier"][scene_type]
 
-        client_calls.append(
-            partial(
-                tts_client.generate_tts_audio,
-                text=text,
-                voice=voice,
-                save_file=save_file,
-                speed=speed,
-            )
+def drop_failed_lines(config, script_lines, audio_clips):
+    # One flaky line shouldn't cost the whole script, too many and it's not worth playing
+    failed = sum(audio_clip is None for audio_clip in audio_clips)
+    if not failed:
+        return (script_lines, audio_clips)
+
+    max_share = config["tts"].get(
+        "max_dropped_line_share", DEFAULT_MAX_DROPPED_LINE_SHARE
+    )
+    if failed > len(audio_clips) * max_share or len(audio_clips) - failed < 2:
+        raise RuntimeError(f"TTS failed for {failed} of {len(audio_clips)} lines")
+    logger.warning(f"dropping {failed} of {len(audio_clips)} lines that failed TTS")
+    DROPPED_LINES.inc(failed)
+    kept = [
+        (script_line, audio_clip)
+        for script_line, audio_clip in zip(script_lines, audio_clips)
+        if audio_clip is not None
+    ]
+    return (
+        [script_line for script_line, _ in kept],
+        [audio_clip for _, audio_clip in kept],
+    )
+
+
+def parse_script_lines(script_rows, guest_type):
+    logger.info(f"Generating script for the following: {guest_type} \n{script_rows}")
+    script_lines = list(script_rows or [])
+    if len(script_lines) < 2:
+        raise RuntimeError(
+            f"script components too short, only {len(script_lines)} lines"
         )
 
-    return client_calls
+    # Apparently AI generation can result in voice switching
+    guest_gender = get_gender(script_lines[1].gender, guest_type)
 
+    return (script_lines, guest_gender)
 
-def generate_animation_file(script_components):
-    animation_file = []
 
-    for script_component in script_components[:-1]:
-        text = get_script_component_text(script_component)
-        text = text.strip().strip('"').strip("'").strip()
+def render_script(
+    tts_client,
+    config,
+    script_lines,
+    guest_type,
+    guest_gender,
+    scene_type,
+    segment_publisher=None,
+    deadline=None,
+):
+    tm1 = time.perf_counter()
+    deadline = deadline or script_deadline(config)
+    client_calls = build_script_client_calls(
+        config,
+        script_lines,
+        tts_client,
+        script_type=guest_type,
+        guest_gender=guest_gender,
+        scene_type=scene_type,
+        deadline=deadline,
+    )
+    futures = []
+
+    if segment_publisher:
+        segment_publisher.start(guest_gender)
+    for index, client_call in enumerate(client_calls):
+        future = tts_client.submit(client_call)
+        if segment_publisher:
+            segment_publisher.add_line(index, script_lines[index], future)
+        futures.append(future)
+
+    audio_clips = wait_for_audio(futures, deadline)
+    (script_lines, rendered_clips) = drop_failed_lines(
+        config, script_lines, audio_clips
+    )
+    if segment_publisher:
+        segment_publisher.finish(audio_clips)
+    audio_clips = rendered_clips
 
-        is_host = (
-            constants.DEFAULT_NAME.lower() in script_component["name"].lower()
-            or "poe" in script_component["name"].lower()
-        )
-        if is_host:
-            camera = 1
-            character_pose = [1, 0]
-        else:
-            camera = 2
-            character_pose = [0, 1]
-
-        animation_file.append(
-            {
-                "camera": camera,
-                "characterPose": character_pose,
-                # This used to be a real value, stub in one and retrieve from files instead
-                "length": 1,
-                "text": text,
-            }
+    tm2 = time.perf_counter()
+    SCRIPT_TTS_SECONDS.observe(tm2 - tm1)
+    logger.info(f"Total time elapsed for TTS: {tm2-tm1:0.2f} seconds")
+    logger.info(f"TTS cache stats: {tts_client.cache_stats()}")
+    logger.info(f"TTS hosts: {tts_client.host_stats()}")
+
+    animation_script = generate_animation_file(script_lines)
+    script_metadata = {
+        # 2nd line should generally be the guest
+        "guest_gender": guest_gender
+    }
+    # Segments have already gone out as separate clips, so there's nothing to stitch
+    if config["tts"].get("stitch_audio") and not segment_publisher:
+        audio_clips = stitch_script_audio(
+            animation_script, audio_clips, script_metadata
         )
 
-    text = get_script_component_text(script_components[-1])
-    text = text.strip().strip('"').strip("'").strip()
-    animation_file.append(
-        {"camera": 0, "characterPose": [0, 0], "length": 1, "text": text}
-    )
-    return animation_file
+    return (animation_script, audio_clips, script_metadata)
 
 
-def generate_files(tts_client, config, csv_text, guest_type, scene_type):
-    f = StringIO(unidecode.unidecode(csv_text))
-    reader = csv.DictReader(
-        f, delimiter="|", skipinitialspace=True, quoting=csv.QUOTE_NONE
+def generate_files(
+    tts_client,
+    config,
+    script_rows,
+    guest_type,
+    scene_type,
+    segment_publisher=None,
+    deadline=None,
+):
+    (script_lines, guest_gender) = parse_script_lines(script_rows, guest_type)
+    return render_script(
+        tts_client,
+        config,
+        script_lines,
+        guest_type=guest_type,
+        guest_gender=guest_gender,
+        scene_type=scene_type,
+        segment_publisher=segment_publisher,
+        deadline=deadline,
     )
-    script_components = [line for line in reader]
 
-    logger.info(
-        f"Generating script for the following: {guest_type} \n{csv_text} \n{script_components}"
-    )
-    script_components = [
-        line
-        for line in script_components
-        if line.get("name") != None
-        and line.get("gender") != None
-        and line.get("text") != None
-    ]
-    # Apparently AI generation can result in voice switching
-    guest_gender = script_components[1]["gender"].strip().strip('"').strip("'").strip()
-    guest_gender = get_gender(guest_gender, guest_type)
 
+def render_streamed_script(
+    tts_client,
+    config,
+    script_rows,
+    guest_type,
+    scene_type,
+    segment_publisher=None,
+    deadline=None,
+):
+    # Same as render_script, but starts the TTS for each line as soon as the LLM finishes it
     tm1 = time.perf_counter()
-    audio_base64 = []
-    animation_script = generate_animation_file(script_components)
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        client_calls = build_script_client_calls(
+    deadline = deadline or script_deadline(config)
+    first_audio_time = []
+    voices, speeds = _build_voice_map(config)
+    logger.info(f"Using voices {voices}")
+
+    script_lines = []
+    futures = []
+    guest_gender = None
+
+    def submit_pending_lines():
+        if segment_publisher and not futures:
+            segment_publisher.start(guest_gender)
+        pending_lines = script_lines[len(futures) :]
+        assign_voices(
             config,
-            script_components,
-            tts_client,
+            pending_lines,
+            voices,
+            speeds,
             script_type=guest_type,
             guest_gender=guest_gender,
             scene_type=scene_type,
         )
-        futures = []
+        for script_line in pending_lines:
+            client_call = build_script_client_call(
+                script_line, tts_client, deadline=deadline
+            )
+            future = tts_client.submit(client_call)
+            if not futures:
+                future.add_done_callback(
+                    lambda _: first_audio_time.append(time.perf_counter())
+                )
+            if segment_publisher:
+                segment_publisher.add_line(len(futures), script_line, future)
+            futures.append(future)
+
+    try:
+        for script_line in script_rows:
+            script_lines.append(script_line)
+            # Guest voice depends on the 2nd line, so hold off until it's available
+            if guest_gender is None and len(script_lines) >= 2:
+                guest_gender = get_gender(script_lines[1].gender, guest_type)
+            if guest_gender is not None:
+                submit_pending_lines()
+    except Exception:
+        # The script is lost, so free up the shared TTS workers for the next one
+        for future in futures:
+            future.cancel()
+        raise
 
-        for client_call in client_calls:
-            futures.append(executor.submit(client_call))
+    logger.info(
+        f"Generated streamed script for the following: {guest_type} \n{script_lines}"
+    )
+    if len(script_lines) < 2:
+        raise RuntimeError(
+            f"script components too short, only {len(script_lines)} lines"
+        )
 
-        concurrent.futures.wait(futures)
-        audio_base64 = [future.result()[1] for future in futures]
+    audio_clips = wait_for_audio(futures, deadline)
+    (script_lines, rendered_clips) = drop_failed_lines(
+        config, script_lines, audio_clips
+    )
+    if segment_publisher:
+        segment_publisher.finish(audio_clips)
+    audio_clips = rendered_clips
 
     tm2 = time.perf_counter()
-    logger.info(f"Total time elapsed for TTS: {tm2-tm1:0.2f} seconds")
+    first_audio_time.append(tm2)
+    FIRST_LINE_SECONDS.observe(first_audio_time[0] - tm1)
+    logger.info(
+        f"Time to first TTS line: {first_audio_time[0]-tm1:0.2f} seconds, total time elapsed for LLM and TTS: {tm2-tm1:0.2f} seconds"
+    )
+    logger.info(f"TTS cache stats: {tts_client.cache_stats()}")
+    logger.info(f"TTS hosts: {tts_client.host_stats()}")
 
+    animation_script = generate_animation_file(script_lines)
     script_metadata = {
         # 2nd line should generally be the guest
         "guest_gender": guest_gender
     }
+    # Segments have already gone out as separate clips, so there's nothing to stitch
+    if config["tts"].get("stitch_audio") and not segment_publisher:
+        audio_clips = stitch_script_audio(
+            animation_script, audio_clips, script_metadata
+        )
 
-    return (animation_script, audio_base64, script_metadata)
+    return (animation_script, audio_clips, script_metadata)
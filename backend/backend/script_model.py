@@ -0,0 +1,57 @@
+import constants
+
+HOST_ROLE = "host"
+GUEST_ROLE = "guest"
+
+
+def is_host_name(name):
+    lowered_name = name.lower()
+    return constants.DEFAULT_NAME.lower() in lowered_name or "poe" in lowered_name
+
+
+def strip_wrapping_quotes(text):
+    text = text.strip()
+    while len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'":
+        text = text[1:-1].strip()
+    # A quote left without its pair at either end, like a line that only opens one
+    for quote in "\"'":
+        if text.count(quote) % 2 == 0:
+            continue
+        if text.startswith(quote):
+            text = text[1:].strip()
+        elif text.endswith(quote):
+            text = text[:-1].strip()
+    return text
+
+
+# One line of a script, built once by the parser and passed through TTS planning,
+# animation and payload building. voice and speed are filled in once voices are picked.
+class ScriptLine:
+    __slots__ = ("name", "gender", "text", "role", "voice", "speed")
+
+    def __init__(self, name, gender, text, role, voice=None, speed=None):
+        self.name = name
+        self.gender = gender
+        self.text = text
+        self.role = role
+        self.voice = voice
+        self.speed = speed
+
+    @classmethod
+    def from_fields(cls, name, gender, text):
+        return cls(
+            name=name,
+            gender=gender,
+            text=strip_wrapping_quotes(text),
+            role=HOST_ROLE if is_host_name(name) else GUEST_ROLE,
+        )
+
+    @property
+    def is_host(self):
+        return self.role == HOST_ROLE
+
+    def to_fields(self):
+        return [self.name, self.gender, self.text]
+
+    def __repr__(self):
+        return f"ScriptLine({self.role}, {self.name!r}, {self.gender!r}, {self.text!r})"
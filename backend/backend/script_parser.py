@@ -0,0 +1,141 @@
+import unidecode
+
+from script_model import ScriptLine
+
+SCRIPT_FIELDS = ("name", "gender", "text")
+CODE_FENCE = "```"
+# How models usually start talking about the script once it's done
+CHATTER_PREFIXES = (
+    "note:",
+    "note that",
+    "this script",
+    "i hope",
+    "let me know",
+    "feel free",
+)
+
+
+def _is_separator_line(line):
+    # Markdown table separators, e.g. |---|---|---|
+    return "-" in line and not line.strip("|-: \t")
+
+
+def _is_header_row(fields):
+    lowered = [_clean_field(field).lower() for field in fields]
+    return "name" in lowered and "gender" in lowered
+
+
+def _is_chatter_line(line):
+    return line.lstrip("*_(").lower().startswith(CHATTER_PREFIXES)
+
+
+def _clean_field(field):
+    # Models like to quote or bold the name and gender columns
+    return field.strip().strip("\"'*").strip()
+
+
+# Turns raw model output into ScriptLines, fed either a whole response or a token stream.
+# A row is only finished once the next row starts (or the output ends), since models like
+# to wrap long lines of dialog over several lines. A blank line or the model starting to
+# comment on the script ends the wrapping, anything after that isn't dialog.
+class ScriptRowParser:
+    def __init__(self):
+        self._partial_line = []
+        self._row = None
+        self._continuation = []
+        self._wrapping = False
+        self._finished = False
+
+    def feed(self, chunk):
+        if self._finished:
+            return []
+        if "\n" not in chunk:
+            # Hold onto stream chunks until the line is done, rather than re-joining each time
+            self._partial_line.append(chunk)
+            return []
+
+        self._partial_line.append(chunk)
+        lines = "".join(self._partial_line).split("\n")
+        self._partial_line = [lines.pop()]
+        rows = []
+        for line in lines:
+            row = self._feed_line(line)
+            if row:
+                rows.append(row)
+            if self._finished:
+                break
+        return rows
+
+    def close(self):
+        rows = []
+        if self._partial_line and not self._finished:
+            row = self._feed_line("".join(self._partial_line))
+            if row:
+                rows.append(row)
+        self._partial_line = []
+        row = self._take_row()
+        if row:
+            rows.append(row)
+        self._finished = True
+        return rows
+
+    def _feed_line(self, line):
+        line = line.strip()
+        if not line:
+            self._wrapping = False
+            return None
+
+        if line.startswith(CODE_FENCE):
+            if self._row is not None:
+                # Closing fence, anything after this is commentary
+                self._finished = True
+                return self._take_row()
+            return None
+
+        if line.count("|") < 2:
+            if _is_chatter_line(line):
+                self._wrapping = False
+            if self._wrapping:
+                self._continuation.append(line.strip("| "))
+            return None
+
+        if _is_separator_line(line):
+            return None
+
+        fields = line.strip("|").split("|")
+        if len(fields) < len(SCRIPT_FIELDS) or _is_header_row(fields):
+            return None
+
+        finished_row = self._take_row()
+        self._row = fields
+        self._wrapping = True
+        return finished_row
+
+    def _take_row(self):
+        if self._row is None:
+            return None
+
+        name = _clean_field(self._row[0])
+        gender = _clean_field(self._row[1])
+        text = self._row[2].strip()
+        if self._continuation:
+            text = " ".join([text] + self._continuation)
+        self._row = None
+        self._continuation = []
+        self._wrapping = False
+
+        text = " ".join(text.replace("\\n", " ").replace("\\t", " ").split())
+        if not name or not text:
+            return None
+        script_line = ScriptLine.from_fields(
+            unidecode.unidecode(name),
+            unidecode.unidecode(gender),
+            unidecode.unidecode(text),
+        )
+        # Lines that were only quotes have nothing left to say
+        return script_line if script_line.text else None
+
+
+def parse_script(response):
+    parser = ScriptRowParser()
+    return parser.feed(response) + parser.close()
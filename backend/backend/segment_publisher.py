@@ -0,0 +1,105 @@
+import json
+import logging
+import threading
+
+from script_generator import generate_animation_entry
+
+logger = logging.getLogger()
+
+
+# Publishes a script line by line as the TTS finishes, so playback can start before the
+# whole script is rendered. A header goes onto the script queue first, pointing at a
+# per-script list that gets each finished line in playback order, then a completion marker.
+class SegmentPublisher:
+    def __init__(
+        self, redis_client, queue, segment_key, header, encode_audio, ttl=None
+    ):
+        self.redis_client = redis_client
+        self.queue = queue
+        self.segment_key = segment_key
+        self.header = header
+        self.encode_audio = encode_audio
+        self.ttl = ttl
+
+        self.script_lines = []
+        self.audio_clips = {}
+        self.encoded_audio = []
+        self.next_index = 0
+        self.published = 0
+        self.started = False
+        self.finished = False
+        self.lock = threading.RLock()
+
+    def start(self, guest_gender):
+        header = dict(
+            self.header,
+            guestGender=guest_gender,
+            segmented=True,
+            segmentKey=self.segment_key,
+        )
+        self.redis_client.push(json.dumps(header), queue=self.queue)
+        self.started = True
+
+    def add_line(self, index, script_line, future):
+        with self.lock:
+            self.script_lines.append(script_line)
+            # The previous line is now known not to be the last one, so it may be publishable
+            self._flush()
+        future.add_done_callback(lambda future: self._line_rendered(index, future))
+
+    def finish(self, audio_clips):
+        # Done callbacks can lag behind the futures completing, so fill in from the results.
+        # Lines that failed TTS are None and get left out.
+        with self.lock:
+            for index, audio_clip in enumerate(audio_clips):
+                if index >= self.next_index:
+                    self.audio_clips[index] = audio_clip
+            self.finished = True
+            self._flush()
+            self._append_segment({"done": True, "count": self.published})
+
+    def fail(self):
+        if not self.started:
+            return
+        with self.lock:
+            self.finished = True
+            self._append_segment({"done": True, "error": True})
+
+    def _line_rendered(self, index, future):
+        # A failed line is skipped so the ones after it can go out, if too many failed the
+        # renderer raises and closes off the segments instead
+        failed = future.cancelled() or future.exception() is not None
+        with self.lock:
+            if self.finished or index < self.next_index:
+                return
+            self.audio_clips[index] = None if failed else future.result()[1]
+            self._flush()
+
+    def _flush(self):
+        while self.next_index in self.audio_clips:
+            is_last = self.next_index == len(self.script_lines) - 1
+            if is_last and not self.finished:
+                break
+
+            audio_clip = self.audio_clips.pop(self.next_index)
+            # Segment indexes stay contiguous around dropped lines. If the last line is
+            # the one dropped, the script just ends on the shot before it.
+            if audio_clip is not None:
+                audio = self.encode_audio(self.published, audio_clip)
+                self.encoded_audio.append(audio)
+                self._append_segment(
+                    {
+                        "index": self.published,
+                        "animation": generate_animation_entry(
+                            self.script_lines[self.next_index], is_last=is_last
+                        ),
+                        "audio": audio,
+                    }
+                )
+                self.published += 1
+            self.next_index += 1
+
+    def _append_segment(self, segment):
+        self.redis_client.append_segment(
+            self.segment_key, json.dumps(segment), ttl=self.ttl
+        )
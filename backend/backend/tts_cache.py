@@ -0,0 +1,196 @@
+import hashlib
+import os
+import threading
+import uuid
+
+from collections import OrderedDict
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+# Share of the disk budget left after an eviction, so the directory isn't rescanned on
+# every write once it's full
+EVICTION_TARGET = 0.9
+
+
+def normalize_tts_text(text):
+    return " ".join(text.split())
+
+
+def tts_cache_key(text, voice, speed, ssml):
+    key_source = f"{voice}\0{round(float(speed), 4)}\0{int(bool(ssml))}\0{normalize_tts_text(text)}"
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+# In-process tier, least recently used entries are evicted once max_bytes is exceeded
+class MemoryAudioCache:
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+            return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self.entries[key] = audio
+            self.total_bytes += len(audio)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
+# Shared tier on local disk, survives restarts and is shared between generator processes
+# on the same box. Recency is tracked through the file mtime. Each process only sees the
+# files it has touched, so the byte budget is enforced from the directory itself: it gets
+# rescanned once this process has written a slice of the budget since the last scan, and
+# the oldest files are evicted down to EVICTION_TARGET of max_bytes.
+class DiskAudioCache:
+    def __init__(self, path, max_bytes=DEFAULT_DISK_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.bytes_since_scan = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        existing_files = []
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith(".wav"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, file_name))
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                continue
+            existing_files.append(
+                (stat.st_mtime, file_name[: -len(".wav")], stat.st_size)
+            )
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.bytes_since_scan = 0
+        for _, key, size in sorted(existing_files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def _file_path(self, key):
+        return os.path.join(self.path, f"{key}.wav")
+
+    def get(self, key):
+        file_path = self._file_path(key)
+        try:
+            with open(file_path, "rb") as f:
+                audio = f.read()
+            os.utime(file_path)
+        except FileNotFoundError:
+            # Could've been evicted by another process
+            with self.lock:
+                if key in self.entries:
+                    self.total_bytes -= self.entries.pop(key)
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            else:
+                self.entries[key] = len(audio)
+                self.total_bytes += len(audio)
+        return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        # Write then rename, so other processes never read a partial file
+        temp_path = os.path.join(self.path, f".{uuid.uuid4()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(audio)
+        os.replace(temp_path, self._file_path(key))
+
+        evicted_keys = []
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)
+            self.entries[key] = len(audio)
+            self.total_bytes += len(audio)
+            self.bytes_since_scan += len(audio)
+            if (
+                self.total_bytes > self.max_bytes
+                or self.bytes_since_scan > self.max_bytes * (1 - EVICTION_TARGET)
+            ):
+                # Picks up what the other processes wrote (and evicted) since
+                self._scan()
+                if self.total_bytes > self.max_bytes:
+                    while self.total_bytes > self.max_bytes * EVICTION_TARGET:
+                        evicted_key, size = self.entries.popitem(last=False)
+                        self.total_bytes -= size
+                        evicted_keys.append(evicted_key)
+
+        for evicted_key in evicted_keys:
+            try:
+                os.remove(self._file_path(evicted_key))
+            except FileNotFoundError:
+                pass
+
+
+class TTSAudioCache:
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.hits = {type(tier).__name__: 0 for tier in tiers}
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config["tts"].get("cache", {})
+        if cache_config is False:
+            return None
+
+        tiers = [
+            MemoryAudioCache(cache_config.get("memory_bytes", DEFAULT_MEMORY_BYTES))
+        ]
+        if cache_config.get("disk_path"):
+            tiers.append(
+                DiskAudioCache(
+                    cache_config["disk_path"],
+                    cache_config.get("disk_bytes", DEFAULT_DISK_BYTES),
+                )
+            )
+        return cls(tiers)
+
+    def get(self, key):
+        for index, tier in enumerate(self.tiers):
+            audio = tier.get(key)
+            if audio is None:
+                continue
+            with self.lock:
+                self.hits[type(tier).__name__] += 1
+            # Promote into the faster tiers
+            for faster_tier in self.tiers[:index]:
+                faster_tier.put(key, audio)
+            return audio
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, audio):
+        for tier in self.tiers:
+            tier.put(key, audio)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": dict(self.hits), "misses": self.misses}
@@ -1,19 +1,82 @@
+import concurrent.futures
 import requests
 import os
+import random
+import time
 import uuid
-import base64
 import logging
+import metrics
 
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from circuit_breaker import CircuitBreaker
+from deadlines import DeadlineExceeded, deadline_passed, request_timeout
+from tts_cache import TTSAudioCache, tts_cache_key
+from tts_pool import TTSHostPool
 
 TTS_GENERATION_PATH = "/api/tts"
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+# Mimic3 being busy or briefly gone, anything else won't get better on a retry
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
 logger = logging.getLogger()
 
+TTS_REQUEST_SECONDS = metrics.histogram(
+    "tts_request_seconds", "Latency of a single line TTS request, by host"
+)
+TTS_CACHE_LOOKUPS = metrics.counter(
+    "tts_cache_lookups_total", "TTS audio cache lookups by result"
+)
+TTS_ERRORS = metrics.counter("tts_errors_total", "Failed TTS requests, by host")
+TTS_RETRIES = metrics.counter("tts_retries_total", "Retried TTS requests")
+
 
 class TTSClient:
     def __init__(self, config):
-        self.url = config["tts"]["host"]
+        max_concurrency = config["tts"].get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        self.timeout = (
+            config["tts"].get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            config["tts"].get("timeout", DEFAULT_READ_TIMEOUT),
+        )
+        self.retries = config["tts"].get("retries", DEFAULT_RETRIES)
+        self.retry_backoff = config["tts"].get("retry_backoff", DEFAULT_RETRY_BACKOFF)
+
+        # Keep-alive connections to every TTS host, sized so every worker gets one
+        self.session = requests.Session()
+        self.pool = TTSHostPool(config, self.session, max_concurrency)
+        adapter = HTTPAdapter(
+            pool_connections=len(self.pool.hosts), pool_maxsize=max_concurrency
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool.start()
+
+        self.cache = TTSAudioCache.from_config(config)
+        self.breaker = CircuitBreaker.from_config(config["tts"], "tts")
+
+        # Shared between scripts, max_concurrency per host caps how many requests each
+        # TTS server sees at once, the adaptive limits find how many it handles well
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency * len(self.pool.hosts),
+            thread_name_prefix="tts",
+        )
+
+    def submit(self, client_call):
+        return self.executor.submit(client_call)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache else None
+
+    def host_stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
 
     def generate_tts_audio(
         self,
@@ -23,6 +86,7 @@ class TTSClient:
         voice="en_US/cmu-arctic_low#jmk",
         name="",
         speed=1.1,
+        deadline=None,
     ):
         # Replace hyphens with periods(will render as pause)
         text = text.replace(" - ", " . ").replace("...", ".")
@@ -34,17 +98,101 @@ class TTSClient:
             "ssml": 1 if ssml else 0,
             "lengthScale": speed,
         }
-        response = requests.post(
-            self.url + TTS_GENERATION_PATH, params=params, data=text
-        )
+        audio = None
+        if self.cache:
+            cache_key = tts_cache_key(text, voice, speed, ssml)
+            audio = self.cache.get(cache_key)
+            TTS_CACHE_LOOKUPS.inc(result="miss" if audio is None else "hit")
+
+        if audio is None:
+            audio = self._request_audio(text, params, deadline=deadline)
+            if self.cache:
+                self.cache.put(cache_key, audio)
 
-        base64_response = base64.b64encode(bytes(response.content)).decode("ascii")
         if save_file:
             dt_string = datetime.now().strftime("%d-%m-%Y_%H")
             file_path = f"audio/{dt_string}/{uuid.uuid4()}_{name}.wav"
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             with open(file_path, "wb") as f:
-                f.write(bytes(response.content))
-            return (file_path, base64_response)
+                f.write(audio)
+            return (file_path, audio)
         else:
-            return (None, base64_response)
+            return (None, audio)
+
+    def _request_audio(self, text, params, deadline=None):
+        # Only lines lost to the servers being down count against the breaker, not bad
+        # input or a deadline used up elsewhere
+        if self.breaker:
+            self.breaker.before_call()
+        try:
+            audio = self._request_audio_with_retries(text, params, deadline=deadline)
+        except Exception as error:
+            if self.breaker:
+                if self._is_retryable(error) and not isinstance(
+                    error, DeadlineExceeded
+                ):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_abandoned()
+            raise
+        if self.breaker:
+            self.breaker.record_success()
+        return audio
+
+    def _request_audio_with_retries(self, text, params, deadline=None):
+        # Retries busy or unreachable servers with jittered exponential backoff, as long
+        # as the retry can still finish before the script's deadline
+        attempt = 0
+        host = None
+        while True:
+            timeout = request_timeout(self.timeout, deadline)
+            (host, started_at) = self.pool.acquire(deadline, exclude=host)
+            rendered_characters = 0
+            overloaded = False
+            try:
+                with TTS_REQUEST_SECONDS.time(host=host.url):
+                    response = self.session.post(
+                        host.url + TTS_GENERATION_PATH,
+                        params=params,
+                        data=text.encode("utf-8"),
+                        timeout=timeout,
+                    )
+                    response.raise_for_status()
+                rendered_characters = len(text)
+                return bytes(response.content)
+            except Exception as error:
+                if isinstance(error, requests.Timeout) and deadline_passed(deadline):
+                    # The timeout was cut down to the time left, so the host isn't to
+                    # blame and shouldn't be backed off or ejected
+                    raise DeadlineExceeded(
+                        "script deadline passed during the TTS request"
+                    ) from error
+                TTS_ERRORS.inc(host=host.url)
+                overloaded = self._is_retryable(error)
+                backoff = self.retry_backoff * 2**attempt * random.uniform(0.5, 1.5)
+                if (
+                    not overloaded
+                    or attempt >= self.retries
+                    or (deadline is not None and time.monotonic() + backoff >= deadline)
+                ):
+                    raise
+                logger.warning(
+                    f"TTS request to {host.url} failed due to {error}, retrying in {backoff:0.2f} seconds"
+                )
+            finally:
+                self.pool.release(
+                    host,
+                    started_at,
+                    characters=rendered_characters,
+                    overloaded=overloaded,
+                )
+            TTS_RETRIES.inc()
+            attempt += 1
+            time.sleep(backoff)
+
+    def _is_retryable(self, error):
+        if isinstance(error, requests.HTTPError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(
+            error, (requests.ConnectionError, requests.Timeout, TimeoutError)
+        )
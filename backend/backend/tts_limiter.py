@@ -0,0 +1,109 @@
+import metrics
+import threading
+import time
+
+from deadlines import DeadlineExceeded
+
+CONCURRENCY_LIMIT = metrics.gauge(
+    "tts_concurrency_limit", "TTS requests allowed in flight at once, by host"
+)
+IN_FLIGHT = metrics.gauge("tts_in_flight", "TTS requests currently in flight, by host")
+
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_LATENCY_TOLERANCE = 2.0
+LATENCY_BACKOFF = 0.75
+ERROR_BACKOFF = 0.5
+# Short lines are mostly fixed overhead, so they're costed as at least this long
+MIN_COST_CHARACTERS = 20
+# How quickly the no-load baseline creeps back up after the server gets slower for good
+BASELINE_DRIFT = 0.01
+
+
+# AIMD limit on concurrent TTS requests. Every request that comes back in time grows the
+# limit by about one per round of requests, a request that's much slower per character
+# than the best seen lately shrinks it by a quarter, and an overload error halves it.
+# Only one decrease happens per round, requests already in flight when the limit dropped
+# don't count against it again. The limit settles where Mimic3 stops getting faster
+# with more parallel requests and starts queueing them instead.
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        max_limit,
+        name="tts",
+        min_limit=DEFAULT_MIN_LIMIT,
+        initial_limit=None,
+        latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(initial_limit or max(self.min_limit, max_limit // 2))
+        self.latency_tolerance = latency_tolerance
+        self.name = name
+
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+        CONCURRENCY_LIMIT.set(self.limit, host=self.name)
+
+    @classmethod
+    def from_config(cls, config, max_limit, name="tts"):
+        limiter_config = config["tts"].get("adaptive_concurrency", {})
+        if limiter_config is False:
+            return None
+        return cls(
+            max_limit,
+            name=name,
+            min_limit=limiter_config.get("min_limit", DEFAULT_MIN_LIMIT),
+            initial_limit=limiter_config.get("initial_limit"),
+            latency_tolerance=limiter_config.get(
+                "latency_tolerance", DEFAULT_LATENCY_TOLERANCE
+            ),
+        )
+
+    def acquire(self, deadline=None):
+        # Returns when the request was let through, which release needs back
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    raise DeadlineExceeded("deadline passed waiting for a TTS slot")
+                self.condition.wait(timeout)
+            self.in_flight += 1
+            IN_FLIGHT.set(self.in_flight, host=self.name)
+            return time.monotonic()
+
+    def release(self, started_at, characters=0, overloaded=False):
+        # Requests that failed for other reasons (bad input) only give their slot back
+        latency = time.monotonic() - started_at
+        with self.condition:
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight, host=self.name)
+            if overloaded:
+                self._decrease(started_at, ERROR_BACKOFF)
+            elif characters:
+                cost = latency / max(characters, MIN_COST_CHARACTERS)
+                if self.baseline is None or cost < self.baseline:
+                    self.baseline = cost
+                else:
+                    self.baseline += BASELINE_DRIFT * (cost - self.baseline)
+                if cost > self.baseline * self.latency_tolerance:
+                    self._decrease(started_at, LATENCY_BACKOFF)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            CONCURRENCY_LIMIT.set(self.limit, host=self.name)
+            self.condition.notify_all()
+
+    def _decrease(self, started_at, factor):
+        if started_at < self.last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_decrease = time.monotonic()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "baseline": self.baseline,
+            }
@@ -0,0 +1,158 @@
+import logging
+import metrics
+import random
+import threading
+import time
+
+from tts_limiter import AdaptiveConcurrencyLimiter
+
+logger = logging.getLogger()
+
+HOST_HEALTHY = metrics.gauge("tts_host_healthy", "Whether a TTS host is in rotation")
+HOST_OUTSTANDING = metrics.gauge(
+    "tts_host_outstanding", "TTS requests routed to a host and not yet finished"
+)
+
+HEALTH_CHECK_PATH = "/api/voices"
+DEFAULT_HEALTH_CHECK_INTERVAL = 5
+DEFAULT_HEALTH_CHECK_TIMEOUT = 5
+DEFAULT_MAX_CONSECUTIVE_FAILURES = 3
+
+
+class TTSHost:
+    def __init__(self, url, limiter, max_concurrency):
+        self.url = url
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        HOST_HEALTHY.set(1, host=url)
+
+    def load(self):
+        # Outstanding requests relative to what the host is currently allowed, so a host
+        # the limiter has backed off gets less of the traffic
+        capacity = self.limiter.limit if self.limiter else self.max_concurrency
+        return self.outstanding / capacity
+
+
+# Mimic3 replicas behind one client. Each line goes to the healthy host with the least
+# outstanding work, and each host gets its own adaptive limit. Hosts leave rotation after
+# a few consecutive connection errors or 5xx responses, or a failed health check, and
+# come back once a health check passes. If every host is down, they're all tried anyway.
+class TTSHostPool:
+    def __init__(self, config, session, max_concurrency):
+        urls = config["tts"].get("hosts") or [config["tts"]["host"]]
+        self.hosts = [
+            TTSHost(
+                url,
+                AdaptiveConcurrencyLimiter.from_config(
+                    config, max_concurrency, name=url
+                ),
+                max_concurrency,
+            )
+            for url in urls
+        ]
+        self.session = session
+        self.health_check_interval = config["tts"].get(
+            "health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL
+        )
+        self.health_check_timeout = config["tts"].get(
+            "health_check_timeout", DEFAULT_HEALTH_CHECK_TIMEOUT
+        )
+        self.max_consecutive_failures = config["tts"].get(
+            "max_consecutive_failures", DEFAULT_MAX_CONSECUTIVE_FAILURES
+        )
+        self.lock = threading.Lock()
+        self.health_check_thread = None
+
+    def start(self):
+        if not self.health_check_interval or self.health_check_thread:
+            return
+        self.health_check_thread = threading.Thread(
+            target=self._health_check_loop, name="tts-health", daemon=True
+        )
+        self.health_check_thread.start()
+
+    def acquire(self, deadline=None, exclude=None):
+        # Retries pass the host that just failed, so they go elsewhere when they can
+        with self.lock:
+            candidates = (
+                [host for host in self.hosts if host.healthy and host is not exclude]
+                or [host for host in self.hosts if host.healthy]
+                or self.hosts
+            )
+            host = min(candidates, key=lambda host: (host.load(), random.random()))
+            host.outstanding += 1
+            HOST_OUTSTANDING.set(host.outstanding, host=host.url)
+        try:
+            started_at = (
+                host.limiter.acquire(deadline) if host.limiter else time.monotonic()
+            )
+        except Exception:
+            self._finish(host)
+            raise
+        return (host, started_at)
+
+    def release(self, host, started_at, characters=0, overloaded=False):
+        if host.limiter:
+            host.limiter.release(
+                started_at, characters=characters, overloaded=overloaded
+            )
+        self._finish(host)
+        with self.lock:
+            if not overloaded:
+                host.consecutive_failures = 0
+                return
+            host.consecutive_failures += 1
+            # Without health checks nothing would bring it back, so keep it in rotation
+            if (
+                self.health_check_interval
+                and host.healthy
+                and host.consecutive_failures >= self.max_consecutive_failures
+            ):
+                self._set_healthy(host, False)
+
+    def _finish(self, host):
+        with self.lock:
+            host.outstanding -= 1
+            HOST_OUTSTANDING.set(host.outstanding, host=host.url)
+
+    def _set_healthy(self, host, healthy):
+        if host.healthy != healthy:
+            logger.warning(
+                f"TTS host {host.url} is {'back in' if healthy else 'out of'} rotation"
+            )
+        host.healthy = healthy
+        if healthy:
+            host.consecutive_failures = 0
+        HOST_HEALTHY.set(1 if healthy else 0, host=host.url)
+
+    def check_health(self, host):
+        try:
+            response = self.session.get(
+                host.url + HEALTH_CHECK_PATH, timeout=self.health_check_timeout
+            )
+            healthy = response.ok
+        except Exception:
+            healthy = False
+        with self.lock:
+            self._set_healthy(host, healthy)
+        return healthy
+
+    def _health_check_loop(self):
+        while True:
+            for host in self.hosts:
+                self.check_health(host)
+            time.sleep(self.health_check_interval)
+
+    def stats(self):
+        with self.lock:
+            return {
+                host.url: {
+                    "healthy": host.healthy,
+                    "outstanding": host.outstanding,
+                    "limiter": host.limiter.stats() if host.limiter else None,
+                }
+                for host in self.hosts
+            }
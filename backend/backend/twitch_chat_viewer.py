@@ -1,4 +1,5 @@
 import constants
+import metrics
 
 from twitchAPI import Twitch
 from twitchAPI.oauth import UserAuthenticator
@@ -7,17 +8,25 @@ from twitchAPI.chat import Chat, EventData, ChatCommand
 from ratelimit import limits, RateLimitException
 from logging.handlers import TimedRotatingFileHandler
 
-from redis_client import RedisClient
+from async_redis_client import AsyncRedisClient
 from chatgpt_client import ChatGPTClient
 from utils import generate_requested_script, prompt_customizations
 
 import json
 import logging
-import time
 import asyncio
 
 USER_SCOPE = [AuthScope.CHAT_READ, AuthScope.CHAT_EDIT]
 TARGET_CHANNEL = "podcastsforever"
+# Upper bound on a blocking pop, so a dropped connection gets noticed
+RELAY_WAIT_SECONDS = 30
+
+CHAT_COMMANDS = metrics.counter(
+    "chat_commands_total", "Chat commands handled, by command and outcome"
+)
+RESPONSES_RELAYED = metrics.counter(
+    "chat_responses_relayed_total", "Script results announced in chat"
+)
 
 logger = logging.getLogger()
 rotating_file_handler = TimedRotatingFileHandler(
@@ -63,18 +72,11 @@ async def generate_rapbattle_script_request(cmd: ChatCommand):
     try:
         payload = do_generate_prompt_request(cmd, scene_type="rapbattle")
     except RateLimitException as e:
+        CHAT_COMMANDS.inc(command=cmd.name, status="rate_limited")
         await cmd.reply(f"Sorry {cmd.user.name}, try again in another minute")
         return
 
-    redis_client.push(
-        payload=json.dumps(payload), queue=redis_client.script_request_queue
-    )
-
-    prompt = payload["prompt"]
-    truncated_str = (prompt[:250] + "..") if len(prompt) > 250 else prompt
-    await cmd.reply(
-        f'OK {cmd.user.name}, queuing up a {payload["type"]} rap battle with the prompt "{truncated_str}"'
-    )
+    await queue_request(cmd, payload, f'a {payload["type"]} rap battle')
 
 
 async def generate_businesstalk_script_request(cmd: ChatCommand):
@@ -94,18 +96,11 @@ async def generate_businesstalk_script_request(cmd: ChatCommand):
             "scene_type": "businesstalk",
         }
     except RateLimitException as e:
+        CHAT_COMMANDS.inc(command=cmd.name, status="rate_limited")
         await cmd.reply(f"Sorry {cmd.user.name}, try again in another minute")
         return
 
-    redis_client.push(
-        payload=json.dumps(payload), queue=redis_client.script_request_queue
-    )
-
-    prompt = payload["prompt"]
-    truncated_str = (prompt[:250] + "..") if len(prompt) > 250 else prompt
-    await cmd.reply(
-        f'OK {cmd.user.name}, queuing up a business talk with the prompt "{truncated_str}"'
-    )
+    await queue_request(cmd, payload, "a business talk")
 
 
 # this will be called whenever the !reply command is issued
@@ -118,15 +113,28 @@ async def generate_script_request(cmd: ChatCommand):
 
     payload = do_generate_prompt_request(cmd, scene_type="podcast")
 
-    redis_client.push(
-        payload=json.dumps(payload), queue=redis_client.script_request_queue
+    await queue_request(cmd, payload, f'a {payload["type"]} script')
+
+
+async def queue_request(cmd: ChatCommand, payload, description):
+    priority = cmd.user.mod or cmd.user.name.lower() in approved_users
+    (status, first_requester) = await redis_client.enqueue_request(
+        payload, priority=priority
     )
+    CHAT_COMMANDS.inc(command=cmd.name, status=status)
 
     prompt = payload["prompt"]
     truncated_str = (prompt[:250] + "..") if len(prompt) > 250 else prompt
-    await cmd.reply(
-        f'OK {cmd.user.name}, queuing up a {payload["type"]} script with the prompt "{truncated_str}"'
-    )
+    if status == "queued":
+        await cmd.reply(
+            f'OK {cmd.user.name}, queuing up {description} with the prompt "{truncated_str}"'
+        )
+    elif status == "merged":
+        await cmd.reply(
+            f"OK {cmd.user.name}, {first_requester} already asked for \"{truncated_str}\", you'll both hear when it's done"
+        )
+    else:
+        await cmd.reply(f'{cmd.user.name}, "{truncated_str}" is already queued up')
 
 
 def do_generate_prompt_request(cmd: ChatCommand, scene_type: str):
@@ -155,20 +163,17 @@ async def get_next_topics(cmd: ChatCommand):
     try:
         check_queue_limit()
     except RateLimitException as e:
+        CHAT_COMMANDS.inc(command=cmd.name, status="rate_limited")
         await cmd.reply(f"Sorry {cmd.user.name}, try again later")
         return
 
-    entries = [
-        json.loads(script)
-        for script in redis_client.read_next_entries(
-            redis_client.requested_script_queue
-        )
-    ]
-
-    in_progress_prompts = [
-        json.loads(script)
-        for script in redis_client.read_next_entries(redis_client.script_request_queue)
-    ]
+    (raw_entries, raw_in_progress_prompts) = await asyncio.gather(
+        redis_client.read_next_entries(redis_client.requested_script_queue),
+        redis_client.read_pending_requests(),
+    )
+    CHAT_COMMANDS.inc(command=cmd.name, status="ok")
+    entries = [json.loads(script) for script in raw_entries]
+    in_progress_prompts = [json.loads(script) for script in raw_in_progress_prompts]
 
     prefix = "Upcoming Prompts:\n"
     entries = [
@@ -180,17 +185,62 @@ async def get_next_topics(cmd: ChatCommand):
     await cmd.send(prefix + result)
 
     in_progress_prompts_prefix = "Generating Prompts:\n\n"
+    # Already in the order they'll be generated in
     entries = [
         f"{entry['name']}: {entry['prompt'][:100]}{'...' if len(entry['prompt']) > 100 else ''}"
         for entry in in_progress_prompts
     ]
-    entries.reverse()
     result = "\n\n".join(entries)
     await cmd.send(in_progress_prompts_prefix + result)
 
     return
 
 
+async def relay_responses(chat: Chat):
+    while True:
+        try:
+            raw_response_payload = await redis_client.wait_for_queue_content(
+                redis_client.script_request_response_queue,
+                timeout=RELAY_WAIT_SECONDS,
+            )
+        except Exception:
+            logger.exception("failed to read script responses")
+            await asyncio.sleep(RELAY_WAIT_SECONDS)
+            continue
+        if not raw_response_payload:
+            continue
+
+        response_payload = json.loads(raw_response_payload)
+        logger.info(response_payload)
+        RESPONSES_RELAYED.inc(success=response_payload["success"])
+        if response_payload["success"]:
+            status_string = "successful!"
+        else:
+            status_string = "unsuccessful :("
+        try:
+            prompt = response_payload["prompt"]
+            truncated_str = (prompt[:250] + "..") if len(prompt) > 250 else prompt
+            await chat.send_message(
+                TARGET_CHANNEL,
+                f"{response_payload['name']}, Prompt: \"{truncated_str}\" was {status_string}",
+            )
+        except Exception:
+            pass
+
+
+async def publish_metrics_snapshots(interval):
+    while True:
+        try:
+            await redis_client.redis_client.set(
+                metrics.snapshot_key("chatbot"),
+                metrics.snapshot_payload("chatbot"),
+                ex=int(interval * 3),
+            )
+        except Exception:
+            logger.exception("failed to publish metrics snapshot")
+        await asyncio.sleep(interval)
+
+
 async def run():
     global redis_client, chatgpt_client, approved_users
     with open("config.json", "r") as json_file:
@@ -199,7 +249,17 @@ async def run():
     app_id = cfg["chatbot"]["client_id"]
     app_secret = cfg["chatbot"]["client_secret"]
     approved_users = cfg["chatbot"]["approved_users"]
-    redis_client = RedisClient(config=cfg)
+    redis_client = AsyncRedisClient(config=cfg)
+    # Snapshots go through the async client, so only the endpoint is started here
+    metrics.start_from_config(cfg, "chatbot")
+    snapshot_interval = cfg.get("metrics", {}).get(
+        "snapshot_interval_seconds", metrics.DEFAULT_SNAPSHOT_INTERVAL_SECONDS
+    )
+    snapshot_task = (
+        asyncio.create_task(publish_metrics_snapshots(snapshot_interval))
+        if snapshot_interval
+        else None
+    )
     chatgpt_client = ChatGPTClient(config=cfg)
 
     # set up twitch api instance and add user authentication with some scopes
@@ -221,35 +281,19 @@ async def run():
 
     chat.start()
 
-    # lets run till we press enter in the console
+    # Results get relayed from their own task, waiting on the queue without holding up
+    # the command handlers
+    relay_task = asyncio.create_task(relay_responses(chat))
     try:
-        while True:
-            raw_response_payload = redis_client.get_queue_content(
-                redis_client.script_request_response_queue
-            )
-            if raw_response_payload:
-                response_payload = json.loads(raw_response_payload)
-                logger.info(response_payload)
-                if response_payload["success"]:
-                    status_string = "successful!"
-                else:
-                    status_string = "unsuccessful :("
-                try:
-                    prompt = response_payload["prompt"]
-                    truncated_str = (
-                        (prompt[:250] + "..") if len(prompt) > 250 else prompt
-                    )
-                    await chat.send_message(
-                        TARGET_CHANNEL,
-                        f"{response_payload['name']}, Prompt: \"{truncated_str}\" was {status_string}",
-                    )
-                except Exception:
-                    pass
-            time.sleep(5)
+        await relay_task
     finally:
         # now we can close the chat bot and the twitch api client
+        relay_task.cancel()
+        if snapshot_task:
+            snapshot_task.cancel()
         chat.stop()
         await twitch.close()
+        await redis_client.close()
 
 
 if __name__ == "__main__":
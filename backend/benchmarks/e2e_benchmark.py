@@ -0,0 +1,439 @@
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fake_servers import (
+    FakeLLMHandler,
+    FakeTTSHandler,
+    llm_replica,
+    server_url,
+    start_server,
+    tts_replica,
+)
+
+parser = argparse.ArgumentParser(
+    description="Runs the generator end to end against local LLM, TTS and Redis stand-ins"
+)
+parser.add_argument(
+    "--mode",
+    help="single calls do_generate_script back to back, loop and pipeline run the --infinite generator",
+    choices=["single", "loop", "pipeline"],
+    default="single",
+)
+parser.add_argument("--stream", help="Streams the LLM output", action="store_true")
+parser.add_argument(
+    "--scripts", help="Stops after this many scripts are published", type=int, default=5
+)
+parser.add_argument(
+    "--duration",
+    help="Also stops after this many seconds, for the loop and pipeline modes",
+    type=float,
+    default=300,
+)
+parser.add_argument(
+    "--requested-share",
+    help="Share of scripts that are chat requests, which go through OpenAI",
+    type=float,
+    default=0.0,
+)
+parser.add_argument(
+    "--script-lines", help="Lines in every generated script", type=int, default=12
+)
+parser.add_argument(
+    "--llm-latency", help="Seconds until the first token", type=float, default=0.5
+)
+parser.add_argument(
+    "--llm-token-rate", help="Tokens per second once started", type=float, default=200
+)
+parser.add_argument(
+    "--llm-prompt-rate",
+    help="Prompt tokens per second the fake LLM processes before answering, 0 for instant",
+    type=float,
+    default=0,
+)
+parser.add_argument(
+    "--no-cache-prompt",
+    help="Doesn't ask the local LLM to reuse its cached prompt prefix",
+    action="store_true",
+)
+parser.add_argument(
+    "--llm-stall-rate",
+    help="Share of LLM requests that stall before starting",
+    type=float,
+    default=0,
+)
+parser.add_argument(
+    "--llm-stall-seconds",
+    help="How long a stalled request stalls",
+    type=float,
+    default=10,
+)
+parser.add_argument(
+    "--llm-workers",
+    help="Scripts each fake LLM host generates at once",
+    type=int,
+    default=1,
+)
+parser.add_argument(
+    "--llm-hosts", help="Fake local LLM hosts to balance across", type=int, default=1
+)
+parser.add_argument(
+    "--llm-hedge",
+    help="Hedges slow local LLM requests to another host",
+    action="store_true",
+)
+parser.add_argument(
+    "--openai-latency",
+    help="Seconds until the fake OpenAI's first token, defaults to --llm-latency",
+    type=float,
+)
+parser.add_argument(
+    "--race",
+    help="Races OpenAI and the local LLM for requested scripts",
+    action="store_true",
+)
+parser.add_argument(
+    "--tts-latency", help="Fixed seconds per TTS request", type=float, default=0.05
+)
+parser.add_argument(
+    "--tts-realtime-factor",
+    help="Seconds of rendering per second of speech",
+    type=float,
+    default=0.05,
+)
+parser.add_argument(
+    "--tts-workers",
+    help="Requests each fake TTS host renders at once",
+    type=int,
+    default=2,
+)
+parser.add_argument(
+    "--tts-hosts", help="Fake TTS hosts to balance across", type=int, default=1
+)
+parser.add_argument(
+    "--tts-error-rate", help="Share of TTS requests that fail", type=float, default=0
+)
+parser.add_argument(
+    "--tts-concurrency", help="The TTS client's max_concurrency", type=int, default=8
+)
+parser.add_argument(
+    "--script-deadline",
+    help="Seconds a script gets before it's given up on",
+    type=float,
+    default=600,
+)
+parser.add_argument(
+    "--redis-host", help="Uses a real Redis instead of the in-memory one"
+)
+parser.add_argument("--redis-port", type=int, default=6379)
+parser.add_argument("--json", help="Prints the report as JSON", action="store_true")
+
+LATENCY_METRICS = [
+    "llm_request_seconds",
+    "llm_first_row_seconds",
+    "script_parse_seconds",
+    "tts_request_seconds",
+    "script_tts_seconds",
+    "script_first_line_seconds",
+    "pipeline_stage_seconds",
+    "redis_op_seconds",
+    "script_generation_seconds",
+]
+# Backups are replayed from the library, so they don't count towards throughput
+GENERATED_KINDS = ("auto", "requested")
+
+
+def use_fake_redis():
+    # Every connection the generator opens talks to the same in-memory server
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+    connection_pool = redis.ConnectionPool
+
+    def fake_connection_pool(**kwargs):
+        return connection_pool(
+            connection_class=fakeredis.FakeConnection, server=server, **kwargs
+        )
+
+    redis.ConnectionPool = fake_connection_pool
+
+
+def build_config(args, llm_urls, tts_urls):
+    return {
+        "redis": {
+            "host": args.redis_host or "localhost",
+            "port": args.redis_port,
+            "job_queue": "bench:scripts",
+            "requested_job_queue": "bench:requested_scripts",
+            "request_queue": "bench:requests",
+            "request_response_queue": "bench:responses",
+            "script_cache_ttl": 0,
+        },
+        "local-llama": {
+            "hosts": llm_urls,
+            "hedge": args.llm_hedge,
+            "hedge_delay": args.llm_latency * 4,
+            "cache_prompt": not args.no_cache_prompt,
+        },
+        "chatgpt": {"api_access_token": "benchmark", "race_local": args.race},
+        "tts": {
+            "hosts": tts_urls,
+            "max_concurrency": args.tts_concurrency,
+            "cache": False,
+            "male_voice": [["en_US/fake#male", 1.0]],
+            "female_voice": [["en_US/fake#female", 1.0]],
+            "host_voice": ["en_US/fake#host", 1.0],
+            "robot_voice": ["en_US/fake#robot", 1.0],
+            "scene_type_modifier": {},
+        },
+        "scheduler": {
+            "idle_wait_seconds": 1,
+            "failure_backoff_seconds": 1,
+            "script_deadline_seconds": args.script_deadline,
+        },
+        "metrics": {"snapshot_interval_seconds": 0},
+    }
+
+
+def drain_scripts(redis_client, queues):
+    # Stands in for the frontend, plays scripts as fast as they arrive
+    while True:
+        redis_client.redis_client.brpop(queues, timeout=1)
+
+
+def feed_requests(redis_client, fair_keys, share, stop):
+    import fair_scheduler
+
+    enqueue = redis_client.redis_client.register_script(fair_scheduler.ENQUEUE_REQUEST)
+    index = 0
+    while not stop.is_set():
+        if random.random() < share:
+            index += 1
+            payload = {
+                "name": f"viewer{index % 5}",
+                "prompt": f"benchmark topic number {index}",
+                "type": "normal",
+                "scene_type": "podcast",
+            }
+            enqueue(
+                keys=fair_keys.keys(),
+                args=fair_keys.dispatch_args()
+                + [
+                    fair_scheduler.request_dedup_key(payload),
+                    json.dumps(payload),
+                    payload["name"],
+                    0,
+                ],
+            )
+        stop.wait(1)
+
+
+def counter_total(metrics, name, **labels):
+    # Each label narrows the samples to the given values, e.g. kind=("auto",)
+    return sum(
+        value
+        for _, label_key, value in metrics.registry.metrics[name].samples()
+        if all(dict(label_key).get(label) in values for label, values in labels.items())
+    )
+
+
+def histogram_quantile(histogram, state, quantile):
+    # Interpolates inside the bucket the quantile falls in, like Prometheus does
+    total = state[-1]
+    if not total:
+        return None
+    rank = quantile * total
+    cumulative = 0
+    lower = 0
+    # State is [bucket counts..., over the last bucket, sum, count], only the finite
+    # buckets can be interpolated in
+    for bucket, count in zip(histogram.buckets, state[: len(histogram.buckets)]):
+        if cumulative + count >= rank and count:
+            return lower + (bucket - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bucket
+    # Past the last bucket, which is as much as Prometheus can tell too
+    return histogram.buckets[-1]
+
+
+def latency_report(metrics):
+    report = {}
+    for name in LATENCY_METRICS:
+        histogram = metrics.registry.metrics.get(name)
+        if histogram is None:
+            continue
+        with histogram.lock:
+            states = {key: list(state) for key, state in histogram.values.items()}
+        for key, state in sorted(states.items()):
+            labels = ",".join(f"{label}={value}" for label, value in key)
+            report[f"{name}{{{labels}}}" if labels else name] = {
+                "count": state[-1],
+                "mean": state[-2] / state[-1],
+                "p50": histogram_quantile(histogram, state, 0.5),
+                "p95": histogram_quantile(histogram, state, 0.95),
+            }
+    return report
+
+
+def print_report(report):
+    print(
+        f"{report['mode']}{' stream' if report['stream'] else ''}: "
+        f"{report['scripts']} scripts in {report['elapsed_seconds']:.1f}s, "
+        f"{report['scripts_per_hour']:.0f} scripts/hour, "
+        f"{report['backup_scripts']} backups played, "
+        f"{report['failures']} failures, {report['dropped_lines']} dropped lines, "
+        f"{report['hedged_requests']} hedged LLM requests, "
+        f"{report['breaker_trips']} circuit breaker trips, "
+        f"{report['llm_prompt_tokens']} prompt tokens processed, "
+        f"peak RSS {report['peak_rss_mb']:.1f} MB"
+    )
+    print(f"{'metric':60} {'count':>7} {'p50':>9} {'p95':>9} {'mean':>9}")
+    for name, stats in report["latency"].items():
+        print(
+            f"{name:60} {stats['count']:7d} {stats['p50']:9.4f} "
+            f"{stats['p95']:9.4f} {stats['mean']:9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    FakeLLMHandler.first_token_latency = args.llm_latency
+    FakeLLMHandler.token_rate = args.llm_token_rate
+    FakeLLMHandler.prompt_token_rate = args.llm_prompt_rate
+    FakeLLMHandler.script_lines = args.script_lines
+    FakeLLMHandler.stall_rate = args.llm_stall_rate
+    FakeLLMHandler.stall_seconds = args.llm_stall_seconds
+    FakeTTSHandler.base_latency = args.tts_latency
+    FakeTTSHandler.realtime_factor = args.tts_realtime_factor
+    FakeTTSHandler.error_rate = args.tts_error_rate
+    llm_urls = [
+        server_url(start_server(llm_replica(args.llm_workers)))
+        for _ in range(args.llm_hosts)
+    ]
+    openai_handler = type(
+        "FakeOpenAI",
+        (FakeLLMHandler,),
+        {"first_token_latency": args.openai_latency or args.llm_latency},
+    )
+    openai_url = server_url(start_server(openai_handler))
+    tts_urls = [
+        server_url(start_server(tts_replica(args.tts_workers)))
+        for _ in range(args.tts_hosts)
+    ]
+    # The OpenAI client picks this up, so requested scripts hit the fake LLM too
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    if not args.redis_host:
+        use_fake_redis()
+
+    import constants
+    import main
+    import metrics
+
+    from chatgpt_client import ChatGPTClient
+    from fair_scheduler import FairQueueKeys
+    from tts_client import TTSClient
+
+    cfg = build_config(args, llm_urls, tts_urls)
+    main.setup_generator(cfg)
+    chatgpt_client = ChatGPTClient(config=cfg)
+    tts_client = TTSClient(config=cfg)
+    redis_client = main.redis_client
+
+    threading.Thread(
+        target=drain_scripts,
+        args=(
+            redis_client,
+            [redis_client.script_queue, redis_client.requested_script_queue],
+        ),
+        daemon=True,
+    ).start()
+
+    tm1 = time.perf_counter()
+    if args.mode == "single":
+        for _ in range(args.scripts):
+            requested = random.random() < args.requested_share
+            main.do_generate_script(
+                cfg,
+                chatgpt_client,
+                tts_client,
+                script_prompt=constants.DEFAULT_PROMPT_DISCUSSION_TOPIC,
+                script_requester="benchmark" if requested else None,
+                script_personality=("", ""),
+                stream=args.stream,
+            )
+    else:
+        stop = threading.Event()
+        if args.requested_share > 0:
+            threading.Thread(
+                target=feed_requests,
+                args=(
+                    redis_client,
+                    FairQueueKeys(cfg["redis"]["request_queue"], cfg),
+                    args.requested_share,
+                    stop,
+                ),
+                daemon=True,
+            ).start()
+        main.request_queue.start()
+        run_generator = (
+            main.run_script_pipeline
+            if args.mode == "pipeline"
+            else main.run_script_loop
+        )
+        threading.Thread(
+            target=run_generator,
+            args=(
+                cfg,
+                chatgpt_client,
+                tts_client,
+                [constants.DEFAULT_PROMPT_DISCUSSION_TOPIC],
+            ),
+            kwargs={"stream": args.stream, "fresh": True},
+            daemon=True,
+        ).start()
+        deadline = tm1 + args.duration
+        while (
+            counter_total(metrics, "scripts_published_total", kind=GENERATED_KINDS)
+            < args.scripts
+            and time.perf_counter() < deadline
+        ):
+            time.sleep(0.05)
+        stop.set()
+    elapsed = time.perf_counter() - tm1
+
+    scripts = counter_total(metrics, "scripts_published_total", kind=GENERATED_KINDS)
+    report = {
+        "mode": args.mode,
+        "stream": args.stream,
+        "scripts": scripts,
+        "elapsed_seconds": elapsed,
+        "scripts_per_hour": scripts * 3600 / elapsed,
+        "backup_scripts": counter_total(
+            metrics, "scripts_published_total", kind=("backup",)
+        ),
+        "failures": counter_total(metrics, "script_failures_total"),
+        "dropped_lines": counter_total(metrics, "script_dropped_lines_total"),
+        "hedged_requests": counter_total(metrics, "llm_hedged_requests_total"),
+        "breaker_trips": counter_total(metrics, "circuit_breaker_trips_total"),
+        "llm_requests": FakeLLMHandler.requests_served,
+        "llm_prompt_tokens": FakeLLMHandler.prompt_tokens_processed,
+        "tts_requests": FakeTTSHandler.requests_served,
+        # Kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latency": latency_report(metrics),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    # The generator threads never return
+    os._exit(0)
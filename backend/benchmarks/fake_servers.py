@@ -0,0 +1,241 @@
+import io
+import json
+import os
+import random
+import threading
+import time
+import wave
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GUESTS = [
+    ("Jane Doe", "female"),
+    ("John Smith", "male"),
+    ("Ada Lovelace", "female"),
+    ("Alan Turing", "male"),
+]
+WORDS = (
+    "the podcast forever infinite audio script host guest topic really think "
+    "actually interesting question answer story never always maybe listeners"
+).split()
+
+
+def build_script_text(lines):
+    # Same shape a real model answers with, chatter around a pipe separated table
+    (guest_name, guest_gender) = random.choice(GUESTS)
+    rows = ["name|gender|text"]
+    for index in range(lines):
+        if index % 2 == 0:
+            (name, gender) = ("Poe Reagan", "male")
+        else:
+            (name, gender) = (guest_name, guest_gender)
+        text = " ".join(random.choices(WORDS, k=random.randint(8, 24))).capitalize()
+        rows.append(f'{name}|{gender}|"{text}."')
+    return "Sure, here's the script!\n```\n" + "\n".join(rows) + "\n```\nEnjoy!"
+
+
+def tokenize(text, chars_per_token=4):
+    return [
+        text[index : index + chars_per_token]
+        for index in range(0, len(text), chars_per_token)
+    ]
+
+
+# OpenAI compatible /v1/chat/completions, serves both the local llama and the OpenAI
+# client. Answers after first_token_latency, then at token_rate tokens per second.
+# stall_rate of the requests take stall_seconds longer to start, like a backend that
+# got stuck behind a long generation. Only `workers` requests generate at once.
+# With a prompt_token_rate, the prompt is processed first at that many tokens per second,
+# skipping whatever it shares with the last prompt when cache_prompt is asked for.
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    first_token_latency = 0.5
+    token_rate = 200.0
+    prompt_token_rate = 0.0
+    script_lines = 12
+    stall_rate = 0.0
+    stall_seconds = 10.0
+    workers = None
+    cached_prompt = ""
+    requests_served = 0
+    prompt_tokens_processed = 0
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeLLMHandler.requests_served += 1
+        tokens = tokenize(build_script_text(self.script_lines))
+        if self.workers:
+            with self.workers:
+                self._respond(request, tokens)
+        else:
+            self._respond(request, tokens)
+
+    def _respond(self, request, tokens):
+        self._process_prompt(request)
+        time.sleep(self.first_token_latency)
+        if random.random() < self.stall_rate:
+            time.sleep(self.stall_seconds)
+        try:
+            if request.get("stream"):
+                self._stream(tokens)
+            else:
+                self._complete(request, tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on this one, e.g. it lost a hedge or timed out
+            self.close_connection = True
+
+    def _process_prompt(self, request):
+        if not self.prompt_token_rate:
+            return
+        prompt = "".join(message["content"] for message in request["messages"])
+        shared = 0
+        if request.get("cache_prompt"):
+            shared = len(os.path.commonprefix([prompt, type(self).cached_prompt]))
+        # Replicas are subclasses, so each keeps its own cache
+        type(self).cached_prompt = prompt
+        prompt_tokens = len(tokenize(prompt[shared:]))
+        FakeLLMHandler.prompt_tokens_processed += prompt_tokens
+        time.sleep(prompt_tokens / self.prompt_token_rate)
+
+    def _complete(self, request, tokens):
+        time.sleep(len(tokens) / self.token_rate)
+        self._send_json(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": "".join(tokens),
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        )
+
+    def _stream(self, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for token in tokens:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "fake",
+                "choices": [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(1 / self.token_rate)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def silent_wav(seconds, framerate=22050):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(framerate)
+        wav_file.writeframes(b"\0\0" * int(seconds * framerate))
+    return buffer.getvalue()
+
+
+# Mimic3 compatible /api/tts. Speech runs at chars_per_second, and rendering it takes
+# base_latency plus realtime_factor times its length. Only `workers` requests render at
+# once, like a CPU bound TTS server. error_rate of the requests fail with a 503.
+class FakeTTSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    base_latency = 0.05
+    realtime_factor = 0.05
+    chars_per_second = 15.0
+    error_rate = 0.0
+    workers = threading.BoundedSemaphore(2)
+    requests_served = 0
+
+    def do_POST(self):
+        if not self.path.startswith("/api/tts"):
+            self.send_error(404)
+            return
+        text = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        seconds = max(0.5, len(text) / self.chars_per_second)
+        with self.workers:
+            FakeTTSHandler.requests_served += 1
+            time.sleep(self.base_latency + seconds * self.realtime_factor)
+        if random.random() < self.error_rate:
+            self.send_error(503)
+            return
+        body = silent_wav(seconds)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # Health checks
+        if not self.path.startswith("/api/voices"):
+            self.send_error(404)
+            return
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def llm_replica(workers):
+    # One box, generating `workers` scripts at once
+    return type(
+        "FakeLLMReplica",
+        (FakeLLMHandler,),
+        {"workers": threading.BoundedSemaphore(workers)},
+    )
+
+
+def tts_replica(workers):
+    # Every replica renders on its own CPUs
+    return type(
+        "FakeTTSReplica",
+        (FakeTTSHandler,),
+        {"workers": threading.BoundedSemaphore(workers)},
+    )
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server):
+    return f"http://127.0.0.1:{server.server_port}"
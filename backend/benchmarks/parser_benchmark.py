@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from script_parser import ScriptRowParser, parse_script
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "parser_corpus")
+
+parser = argparse.ArgumentParser(
+    description="Checks the LLM output parser against the corpus and times it"
+)
+parser.add_argument(
+    "--iterations", help="Runs per corpus entry", type=int, default=2000
+)
+parser.add_argument(
+    "--chunk-size",
+    help="Also feed each entry in chunks of this many characters, like a token stream",
+    type=int,
+    default=4,
+)
+
+
+def load_corpus():
+    with open(os.path.join(CORPUS_DIR, "expected.json"), "r") as json_file:
+        expected = json.loads(json_file.read())
+
+    corpus = []
+    for file_name, expected_rows in sorted(expected.items()):
+        with open(os.path.join(CORPUS_DIR, file_name), "r") as f:
+            corpus.append((file_name, f.read(), expected_rows))
+    return corpus
+
+
+def parse_streamed(response, chunk_size):
+    script_parser = ScriptRowParser()
+    rows = []
+    for index in range(0, len(response), chunk_size):
+        rows += script_parser.feed(response[index : index + chunk_size])
+    return rows + script_parser.close()
+
+
+def as_tuples(rows):
+    return [row.to_fields() for row in rows]
+
+
+def time_per_call(fn, iterations):
+    tm1 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    tm2 = time.perf_counter()
+    return (tm2 - tm1) / iterations
+
+
+def run_accuracy(corpus, chunk_size):
+    failures = 0
+    for file_name, response, expected_rows in corpus:
+        for mode, rows in (
+            ("whole", parse_script(response)),
+            ("streamed", parse_streamed(response, chunk_size)),
+        ):
+            if as_tuples(rows) != expected_rows:
+                failures += 1
+                print(f"MISMATCH {file_name} ({mode}): got {as_tuples(rows)}")
+    total = len(corpus) * 2
+    print(f"accuracy: {total - failures}/{total} corpus parses match")
+    return failures
+
+
+def run_timing(corpus, iterations):
+    print(f"{'entry':<36}{'bytes':>8}{'us/parse':>12}")
+    for file_name, response, _ in corpus:
+        per_call = time_per_call(lambda: parse_script(response), iterations)
+        print(f"{file_name:<36}{len(response):>8}{per_call * 1e6:>12.1f}")
+
+    # Parsing cost should grow linearly with the size of the response
+    _, response, _ = corpus[0]
+    for multiplier in (1, 10, 100):
+        scaled_response = response * multiplier
+        per_call = time_per_call(
+            lambda: parse_script(scaled_response), max(1, iterations // multiplier)
+        )
+        print(
+            f"scaling x{multiplier:<4} {len(scaled_response):>8} bytes "
+            f"{per_call * 1e6:>10.1f} us {per_call * 1e9 / len(scaled_response):>8.1f} ns/byte"
+        )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    corpus = load_corpus()
+    failures = run_accuracy(corpus, args.chunk_size)
+    run_timing(corpus, args.iterations)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,49 @@
+import fakeredis
+import importlib
+import os
+import pytest
+import redis
+import sys
+
+# The backend modules import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from redis_client import RedisClient
+
+TEST_CONFIG = {
+    "redis": {
+        "host": "localhost",
+        "port": 6379,
+        "job_queue": "test:scripts",
+        "requested_job_queue": "test:requested_scripts",
+        "request_queue": "test:requests",
+        "request_response_queue": "test:responses",
+    }
+}
+
+
+@pytest.fixture
+def config():
+    return {section: dict(values) for section, values in TEST_CONFIG.items()}
+
+
+@pytest.fixture
+def redis_client(monkeypatch, config):
+    # Every connection talks to the same in-memory server
+    server = fakeredis.FakeServer()
+    connection_pool = redis.ConnectionPool
+    monkeypatch.setattr(
+        redis,
+        "ConnectionPool",
+        lambda **kwargs: connection_pool(
+            connection_class=fakeredis.FakeConnection, server=server, **kwargs
+        ),
+    )
+    return RedisClient(config)
+
+
+@pytest.fixture
+def main_module(monkeypatch, tmp_path):
+    # main starts logging to app.log in the working directory as soon as it's imported
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("main")
@@ -0,0 +1,24 @@
+import constants
+
+from backup_library import BackupScriptLibrary
+
+
+def test_remove_drops_the_script_and_its_bytes(redis_client):
+    library = BackupScriptLibrary(redis_client, config={"redis": {}})
+    library.add("a" * 10)
+    library.add("b" * 5)
+    (script_id, payload) = library.pick_random()
+
+    assert library.remove(script_id) == 1
+    assert library.remove(script_id) == 0
+    assert library.size() == 1
+    assert int(redis_client.redis_client.get(library.bytes_key)) == 15 - len(payload)
+    assert not redis_client.redis_client.hexists(library.sizes_key, script_id)
+    assert not redis_client.redis_client.exists(
+        constants.REDIS_BACKUP_SCRIPT_KEY_PREFIX + script_id
+    )
+
+
+def test_pick_from_an_empty_library(redis_client):
+    library = BackupScriptLibrary(redis_client, config={"redis": {}})
+    assert library.pick_random() == (None, None)
@@ -0,0 +1,29 @@
+import pytest
+import time
+
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+from deadlines import DeadlineExceeded
+
+
+def fail_through(breaker, error, deadline=None):
+    with pytest.raises(type(error)):
+        with breaker.guard(deadline):
+            raise error
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    fail_through(breaker, ConnectionError())
+    assert breaker.state == CLOSED
+    fail_through(breaker, ConnectionError())
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_failures_past_the_deadline_are_abandoned():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    fail_through(breaker, DeadlineExceeded())
+    fail_through(breaker, TimeoutError(), deadline=time.monotonic() - 1)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
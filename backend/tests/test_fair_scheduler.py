@@ -0,0 +1,120 @@
+import json
+
+from fair_scheduler import ENQUEUE_REQUEST, FairQueueKeys, request_dedup_key
+from request_queue import ReliableRequestQueue
+
+
+def enqueue(redis_client, config, name, prompt, priority=False):
+    # Same call the chat bot makes through the async client
+    fair_keys = FairQueueKeys(redis_client.script_request_queue, config)
+    payload = {
+        "name": name,
+        "prompt": prompt,
+        "type": "normal",
+        "scene_type": "podcast",
+    }
+    enqueue_script = redis_client.redis_client.register_script(ENQUEUE_REQUEST)
+    (status, requester) = enqueue_script(
+        keys=fair_keys.keys(),
+        args=fair_keys.dispatch_args()
+        + [
+            request_dedup_key(payload),
+            json.dumps(payload),
+            name,
+            "1" if priority else "0",
+        ],
+    )
+    return (status.decode("utf-8"), requester.decode("utf-8"))
+
+
+def claim_all(redis_client, config):
+    queue = ReliableRequestQueue(redis_client, config, worker_id="worker")
+    claimed = []
+    while True:
+        (_, request) = queue.claim()
+        if request is None:
+            return claimed
+        queue.ack(request)
+        request = json.loads(request)
+        claimed.append((request["name"], request["prompt"]))
+
+
+def test_requesters_take_turns(redis_client, config):
+    for prompt in ["a1", "a2", "a3"]:
+        enqueue(redis_client, config, "alice", prompt)
+    enqueue(redis_client, config, "bob", "b1")
+    enqueue(redis_client, config, "carol", "c1")
+
+    # a1 went straight to the ready queue, then alice is first on the ring
+    assert claim_all(redis_client, config) == [
+        ("alice", "a1"),
+        ("alice", "a2"),
+        ("bob", "b1"),
+        ("carol", "c1"),
+        ("alice", "a3"),
+    ]
+
+
+def test_priority_requesters_get_weighted_turns(redis_client, config):
+    config["redis"]["fair_priority_weight"] = 2
+    # The first request goes straight to the empty ready queue
+    for name in ["n1", "n2", "n3"]:
+        enqueue(redis_client, config, name, f"{name} topic")
+    for name in ["p1", "p2", "p3"]:
+        enqueue(redis_client, config, name, f"{name} topic", priority=True)
+
+    assert [name for (name, _) in claim_all(redis_client, config)] == [
+        "n1",
+        "p1",
+        "p2",
+        "n2",
+        "p3",
+        "n3",
+    ]
+
+
+def test_merged_requesters_get_the_reply(
+    redis_client, config, main_module, monkeypatch
+):
+    # Only requests still waiting to be dispatched get merged, so fill the ready queue
+    enqueue(redis_client, config, "zed", "something else")
+    assert enqueue(redis_client, config, "alice", "Cats vs dogs") == (
+        "queued",
+        "alice",
+    )
+    assert enqueue(redis_client, config, "bob", "cats vs. dogs!") == (
+        "merged",
+        "alice",
+    )
+    assert enqueue(redis_client, config, "bob", "Cats vs dogs") == (
+        "duplicate",
+        "alice",
+    )
+
+    queue = ReliableRequestQueue(redis_client, config, worker_id="worker")
+    (_, other_request) = queue.claim()
+    queue.ack(other_request)
+    monkeypatch.setattr(main_module, "request_queue", queue, raising=False)
+    job = main_module.next_script_job(
+        redis_client, queue, ["filler"], main_module.BufferController(config)
+    )
+    assert job["script_requester"] == "alice"
+    assert job["merged_requesters"] == ["bob"]
+
+    main_module.publish_failure(
+        redis_client,
+        job["script_requester"],
+        job["script_prompt"],
+        claimed_request=job["claimed_request"],
+        merged_requesters=job["merged_requesters"],
+    )
+    responses = [
+        json.loads(response)
+        for response in redis_client.redis_client.lrange(
+            redis_client.script_request_response_queue, 0, -1
+        )
+    ]
+    assert sorted(response["name"] for response in responses) == ["alice", "bob"]
+    assert not any(response["success"] for response in responses)
+    assert redis_client.redis_client.llen(queue.processing_queue) == 0
+    assert claim_all(redis_client, config) == []
@@ -0,0 +1,108 @@
+import pytest
+import time
+
+from llm_race import race_script_streams, race_scripts
+
+
+def fast_then_fails():
+    yield "o1"
+    time.sleep(0.05)
+    raise TimeoutError("stream dropped")
+
+
+def slow_script(lines=10, delay=0.01):
+    time.sleep(0.1)
+    for index in range(lines):
+        time.sleep(delay)
+        yield f"l{index + 1}"
+
+
+def late_but_whole_script(stopped=None):
+    # Nothing at all until the whole script arrives at once
+    time.sleep(0.3)
+    yield from ["o1", "o2", "o3"]
+
+
+def early_but_slow_script(stopped):
+    try:
+        yield "l1"
+        for index in range(5):
+            time.sleep(0.5)
+            yield f"l{index + 2}"
+    finally:
+        stopped.append(time.perf_counter())
+
+
+def fails_at_once():
+    raise ConnectionError("backend down")
+    yield
+
+
+def test_first_backend_to_finish_a_script_wins():
+    script_lines = race_scripts(
+        {"openai": lambda: slow_script(3, 0), "local": lambda: slow_script(2, 0.5)}
+    )
+    assert script_lines == ["l1", "l2", "l3"]
+
+
+def test_finishing_first_wins_over_starting_first():
+    stopped = []
+    started_at = time.perf_counter()
+    script_lines = race_scripts(
+        {
+            "openai": late_but_whole_script,
+            "local": lambda: early_but_slow_script(stopped),
+        }
+    )
+    assert script_lines == ["o1", "o2", "o3"]
+    assert time.perf_counter() - started_at < 1
+    # The loser is cancelled at its next line, not left to finish its script
+    time.sleep(0.5)
+    assert stopped and stopped[0] - started_at < 1
+
+    stopped = []
+    script_rows = race_script_streams(
+        {
+            "openai": late_but_whole_script,
+            "local": lambda: early_but_slow_script(stopped),
+        }
+    )
+    assert list(script_rows) == ["o1", "o2", "o3"]
+
+
+def test_winner_failing_after_its_first_line_falls_back():
+    script_lines = race_scripts({"openai": fast_then_fails, "local": slow_script})
+    assert script_lines == [f"l{index + 1}" for index in range(10)]
+
+
+def test_stream_commits_once_a_backend_has_a_couple_of_lines():
+    # A single line and a failure before the race commits is simply dropped
+    script_rows = race_script_streams({"openai": fast_then_fails, "local": slow_script})
+    assert list(script_rows) == [f"l{index + 1}" for index in range(10)]
+
+    stopped = []
+    script_rows = race_script_streams(
+        {
+            "openai": lambda: slow_script(3, 0),
+            "local": lambda: early_but_slow_script(stopped),
+        }
+    )
+    assert list(script_rows) == ["l1", "l2", "l3"]
+    time.sleep(0.5)
+    assert stopped
+
+
+def test_too_short_a_script_falls_back():
+    script_lines = race_scripts(
+        {"openai": lambda: iter(["o1"]), "local": lambda: slow_script(3)}
+    )
+    assert script_lines == ["l1", "l2", "l3"]
+
+
+def test_fails_when_no_backend_produces_a_script():
+    with pytest.raises((TimeoutError, ConnectionError)):
+        race_scripts({"openai": fast_then_fails, "local": fails_at_once})
+    with pytest.raises(ConnectionError):
+        race_scripts({"openai": fails_at_once, "local": fails_at_once})
+    with pytest.raises(RuntimeError):
+        race_scripts({"openai": lambda: iter(["o1"]), "local": lambda: iter([])})
@@ -0,0 +1,16 @@
+from metrics import Histogram
+
+
+def test_observations_past_the_last_bucket_only_count_towards_inf():
+    histogram = Histogram("x", "test", buckets=(1, 300))
+    histogram.observe(400)
+    histogram.observe(1)
+    samples = {
+        (name, dict(labels).get("le")): value
+        for name, labels, value in histogram.samples()
+    }
+    assert samples[("x_sum", None)] == 401
+    assert samples[("x_count", None)] == 2
+    assert samples[("x_bucket", 1)] == 1
+    assert samples[("x_bucket", 300)] == 1
+    assert samples[("x_bucket", "+Inf")] == 2
@@ -0,0 +1,86 @@
+import pytest
+import threading
+import time
+
+from buffer_controller import BufferController
+from pipeline import ScriptPipeline, StreamHandoff
+
+
+def test_in_flight_jobs_count_until_they_leave_the_pipeline():
+    jobs = iter(range(6))
+    release = threading.Event()
+    seen_in_flight = []
+    finished = []
+
+    def source():
+        job = next(jobs, None)
+        if job is None:
+            pipeline.stop()
+            return None
+        seen_in_flight.append(pipeline.in_flight())
+        return job
+
+    def slow_stage(job):
+        release.wait(5)
+        if job == 1:
+            raise RuntimeError("tts failed")
+        # Dropped jobs leave the pipeline too
+        return None if job == 2 else job
+
+    pipeline = ScriptPipeline(
+        source=source,
+        stages=[
+            ("llm", lambda job: job),
+            ("tts", slow_stage),
+            ("publish", finished.append),
+        ],
+        on_error=lambda stage_name, job, error: finished.append(stage_name),
+    )
+    pipeline.start()
+    # The first stage runs ahead until the queues behind the stuck TTS stage are full
+    while len(seen_in_flight) < 3:
+        threading.Event().wait(0.01)
+    assert seen_in_flight == [0, 1, 2]
+    release.set()
+    pipeline.join()
+    assert pipeline.in_flight() == 0
+    # The error is reported from the TTS thread, so it can land either side of job 0
+    assert sorted(finished, key=str) == [0, 3, 4, 5, "tts"]
+
+
+def test_scripts_in_flight_count_towards_the_buffer_target():
+    buffer_controller = BufferController({"scheduler": {"min_buffered_scripts": 3}})
+    assert buffer_controller.should_generate(1)
+    assert buffer_controller.should_generate(1, in_flight=1)
+    assert not buffer_controller.should_generate(1, in_flight=2)
+
+
+def test_streamed_rows_are_handed_on_while_the_stream_runs():
+    release = threading.Event()
+
+    def stream():
+        yield "l1"
+        release.wait(5)
+        yield "l2"
+        raise ConnectionError("LLM stream dropped")
+
+    handoff = StreamHandoff(stream)
+    script_rows = handoff.script_rows()
+    assert next(script_rows) == "l1"
+    assert not handoff.done.is_set()
+    release.set()
+    assert next(script_rows) == "l2"
+    with pytest.raises(ConnectionError):
+        next(script_rows)
+    assert handoff.done.wait(1)
+
+
+def test_cancelled_stream_stops_at_its_next_row():
+    def stream():
+        for index in range(100):
+            time.sleep(0.01)
+            yield f"l{index + 1}"
+
+    handoff = StreamHandoff(stream)
+    handoff.cancel()
+    assert handoff.done.wait(1)
@@ -0,0 +1,67 @@
+import json
+
+from request_queue import ReliableRequestQueue
+
+
+def push_request(redis_client, name):
+    request = json.dumps({"name": name, "prompt": "cats", "type": "normal"})
+    redis_client.redis_client.lpush(redis_client.script_request_queue, request)
+    return request
+
+
+def expire_lease(queue):
+    queue.redis_client.redis_client.delete(queue.heartbeat_key)
+
+
+def test_claim_and_ack(redis_client, config):
+    queue = ReliableRequestQueue(redis_client, config, worker_id="a")
+    queue.renew_lease()
+    request = push_request(redis_client, "alice")
+
+    assert queue.claim() == (0, request)
+    assert redis_client.redis_client.lrange(queue.processing_queue, 0, -1) == [
+        request.encode("utf-8")
+    ]
+    queue.ack(request)
+    assert redis_client.redis_client.llen(queue.processing_queue) == 0
+    assert queue.claim() == (0, None)
+
+
+def test_expired_workers_requests_go_back_on_the_queue(redis_client, config):
+    crashed = ReliableRequestQueue(redis_client, config, worker_id="crashed")
+    survivor = ReliableRequestQueue(redis_client, config, worker_id="survivor")
+    crashed.renew_lease()
+    survivor.renew_lease()
+    request = push_request(redis_client, "alice")
+    crashed.claim()
+
+    # Still holding its lease, so nothing gets taken from it
+    assert survivor.reap_expired_workers() == []
+    assert survivor.claim() == (0, None)
+
+    expire_lease(crashed)
+    assert survivor.reap_expired_workers() == []
+    assert redis_client.redis_client.llen(crashed.processing_queue) == 0
+    assert not redis_client.redis_client.sismember(survivor.workers_key, "crashed")
+    assert survivor.claim() == (0, request)
+    assert redis_client.redis_client.hget(survivor.attempts_key, request) == b"1"
+
+
+def test_requests_are_dead_lettered_after_max_deliveries(redis_client, config):
+    config["redis"]["max_request_deliveries"] = 2
+    request = push_request(redis_client, "alice")
+    reaper = ReliableRequestQueue(redis_client, config, worker_id="reaper")
+
+    for attempt in range(2):
+        worker = ReliableRequestQueue(redis_client, config, worker_id=f"w{attempt}")
+        worker.renew_lease()
+        assert worker.claim() == (0, request)
+        expire_lease(worker)
+        dead_requests = reaper.reap_expired_workers()
+
+    assert dead_requests == [request]
+    assert redis_client.redis_client.lrange(reaper.dead_letter_queue, 0, -1) == [
+        request.encode("utf-8")
+    ]
+    assert redis_client.redis_client.llen(redis_client.script_request_queue) == 0
+    assert not redis_client.redis_client.hexists(reaper.attempts_key, request)
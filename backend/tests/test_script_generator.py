@@ -0,0 +1,55 @@
+import concurrent.futures
+import pytest
+import threading
+
+from script_generator import render_streamed_script
+from script_parser import parse_script
+
+TTS_CONFIG = {
+    "tts": {
+        "male_voice": [["fake#male", 1.0]],
+        "female_voice": [["fake#female", 1.0]],
+        "host_voice": ["fake#host", 1.0],
+        "robot_voice": ["fake#robot", 1.0],
+        "scene_type_modifier": {},
+    }
+}
+
+
+class BlockedTTSClient:
+    # One TTS worker, stuck on the first line until released
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.release = threading.Event()
+        self.futures = []
+
+    def submit(self, client_call):
+        future = self.executor.submit(client_call)
+        self.futures.append(future)
+        return future
+
+    def generate_tts_audio(self, text, **kwargs):
+        self.release.wait(5)
+        return (None, b"")
+
+
+def test_pending_lines_are_cancelled_when_the_stream_fails():
+    script_lines = parse_script(
+        "\n".join(f"Poe Reagan|male|line {index}" for index in range(5))
+    )
+
+    def script_rows():
+        yield from script_lines
+        raise ConnectionError("LLM stream dropped")
+
+    tts_client = BlockedTTSClient()
+    try:
+        with pytest.raises(ConnectionError):
+            render_streamed_script(
+                tts_client, TTS_CONFIG, script_rows(), "normal", "podcast"
+            )
+        assert len(tts_client.futures) == 5
+        assert all(future.cancelled() for future in tts_client.futures[1:])
+    finally:
+        tts_client.release.set()
+        tts_client.executor.shutdown()
@@ -0,0 +1,46 @@
+from script_parser import ScriptRowParser, parse_script
+
+WRAPPED_LAST_LINE = (
+    "name|gender|text\n"
+    "Poe Reagan|male|So how are you doing after all that?\n"
+    "Dana Cole|female|I am fine and I would\n"
+    "like to say goodbye now\n"
+)
+
+
+def parse_streamed(response, chunk_size=4):
+    script_parser = ScriptRowParser()
+    rows = []
+    for index in range(0, len(response), chunk_size):
+        rows += script_parser.feed(response[index : index + chunk_size])
+    return rows + script_parser.close()
+
+
+def test_wrapped_last_line_keeps_its_tail():
+    for rows in (parse_script(WRAPPED_LAST_LINE), parse_streamed(WRAPPED_LAST_LINE)):
+        assert rows[-1].text == "I am fine and I would like to say goodbye now"
+    # Also when the output stops partway through the wrapped line
+    rows = parse_script(WRAPPED_LAST_LINE.rstrip("\n"))
+    assert rows[-1].text == "I am fine and I would like to say goodbye now"
+
+
+def test_chatter_after_the_script_is_dropped():
+    for chatter in ("\nThis script ends the show.\n", "Note: this script is\n"):
+        rows = parse_script(WRAPPED_LAST_LINE + chatter)
+        assert len(rows) == 2
+        assert rows[-1].text == "I am fine and I would like to say goodbye now"
+
+
+def test_quotes_are_stripped_from_the_text():
+    rows = parse_script(
+        'Poe Reagan|male|"Hey there"\n'
+        'Poe Reagan|male|"Hey\n'
+        "Poe Reagan|male|Bye now'\n"
+        'Poe Reagan|male|"Bonjour" Poe!\n'
+    )
+    assert [row.text for row in rows] == [
+        "Hey there",
+        "Hey",
+        "Bye now",
+        '"Bonjour" Poe!',
+    ]
@@ -0,0 +1,25 @@
+import os
+
+from tts_cache import DiskAudioCache
+
+
+def directory_bytes(path):
+    return sum(
+        os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path)
+    )
+
+
+def test_disk_budget_holds_across_processes(tmp_path):
+    # Two generator processes sharing the directory, each only seeing its own writes
+    caches = [DiskAudioCache(str(tmp_path), max_bytes=1000) for _ in range(2)]
+    for index in range(40):
+        caches[index % 2].put(f"line{index}", b"x" * 100)
+
+    # Each process can overshoot by what it writes between rescans
+    assert directory_bytes(tmp_path) <= 1200
+    assert caches[0].get("line39") == b"x" * 100
+
+
+def test_hits_survive_a_restart(tmp_path):
+    DiskAudioCache(str(tmp_path)).put("line", b"audio")
+    assert DiskAudioCache(str(tmp_path)).get("line") == b"audio"
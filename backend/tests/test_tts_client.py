@@ -0,0 +1,64 @@
+import pytest
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from circuit_breaker import CLOSED
+from deadlines import DeadlineExceeded
+from tts_client import TTSClient
+
+
+class SlowMimic3Handler(BaseHTTPRequestHandler):
+    latency = 2
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.latency)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        return
+
+
+@pytest.fixture
+def slow_tts_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowMimic3Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_deadline_cut_timeouts_dont_count_against_the_host(slow_tts_url):
+    client = TTSClient(
+        {
+            "tts": {
+                "host": slow_tts_url,
+                "max_concurrency": 4,
+                "cache": False,
+                "health_check_interval": 0,
+            }
+        }
+    )
+    host = client.pool.hosts[0]
+    initial_limit = host.limiter.limit
+    try:
+        for _ in range(client.breaker.failure_threshold):
+            with pytest.raises(DeadlineExceeded):
+                client.generate_tts_audio(
+                    "hello there", deadline=time.monotonic() + 0.3
+                )
+    finally:
+        client.close()
+
+    assert client.breaker.state == CLOSED
+    assert client.breaker.failures == 0
+    assert host.healthy
+    assert host.consecutive_failures == 0
+    assert host.limiter.limit == initial_limit